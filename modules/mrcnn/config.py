@@ -139,6 +139,16 @@ class Config(object):
     # Image mean (RGB)
     MEAN_PIXEL = np.array([123.7, 116.8, 103.9])
 
+    # Directory of pre-resized training samples (see model.SampleStore).
+    # If set, each dataset is resized once and stored there, and training
+    # reads the memory-mapped samples instead of resizing every epoch.
+    # Only used without augmentation and with a resize mode other than "crop".
+    SAMPLE_STORE_DIR = None
+
+    # Number of most recently used stores kept in SAMPLE_STORE_DIR. Stores
+    # of older datasets or configs are deleted. None keeps all of them.
+    SAMPLE_STORE_KEEP = 4
+
     # Number of ROIs per image to feed to classifier/mask heads
     # The Mask RCNN paper uses 512 but often the RPN doesn't generate
     # enough positive proposals to fill this and keep a positive:negative
@@ -210,6 +220,21 @@ class Config(object):
     # Gradient norm clipping
     GRADIENT_CLIP_NORM = 5.0
 
+    # Number of processes preparing training batches. The default 0 prepares
+    # batches in the training process. None uses up to 4, one per CPU core.
+    # Validation batches get a quarter as many (at least 1). Each worker
+    # keeps its own copy of the dataset and its in-RAM image and mask caches,
+    # so memory grows with the number of workers.
+    DATA_WORKERS = 0
+
+    # Number of batches the workers prepare ahead of the training step. The
+    # keras input queue holds at most as many batches.
+    DATA_PREFETCH = 8
+
+    # Seed for the sample order and random sampling of the data workers.
+    # None picks a new seed for every training run.
+    DATA_SEED = None
+
     def __init__(self):
         """Set values of computed attributes."""
         # Effective batch size
@@ -8,11 +8,15 @@ Written by Waleed Abdulla
 """
 
 import datetime
+import hashlib
+import json
 import math
 import multiprocessing
 import os
 import re
+import shutil
 import sys
+import threading
 from collections import OrderedDict
 # Requires TensorFlow 2.0+
 from distutils.version import LooseVersion
@@ -1303,6 +1307,230 @@ def load_image_gt(dataset, config, image_id, augmentation=None):
     return image, image_meta, class_ids, bbox, mask
 
 
+class SampleStore(object):
+    """Memory-mapped store of the samples load_image_gt() returns.
+
+    Resizing images and masks is deterministic unless augmentation or the
+    "crop" resize mode is used. In that case, the store runs load_image_gt()
+    once per image and saves the result under store_dir. DataGenerator then
+    reads the samples back without decoding or resizing anything.
+
+    Files in store_dir:
+    images.raw: Flat uint8 images of all samples.
+    masks.raw: Masks of all samples as bits of utils.PackedMasks, 8 pixels
+        per byte. load() returns them as PackedMasks views of the file.
+    index.npz: Offsets and shapes into the raw files, plus image_metas,
+        class_ids, bboxes and per-image instance offsets.
+    meta.json: Signature of the dataset and config. It is written last, so
+        its presence marks a complete store.
+
+    Images are stored resized but not molded (uint8 rather than float32);
+    DataGenerator molds them when filling a batch.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        with np.load(os.path.join(store_dir, "index.npz")) as index:
+            self.image_offsets = index["image_offsets"]
+            self.image_shapes = index["image_shapes"]
+            self.mask_offsets = index["mask_offsets"]
+            self.mask_shapes = index["mask_shapes"]
+            self.instance_offsets = index["instance_offsets"]
+            self.image_metas = index["image_metas"]
+            self.class_ids = index["class_ids"]
+            self.bboxes = index["bboxes"]
+        self.images = self._map("images.raw", np.uint8, self.image_offsets[-1])
+        self.masks = self._map("masks.raw", np.uint8, self.mask_offsets[-1])
+
+    def _map(self, name, dtype, size):
+        if size == 0:
+            return np.zeros([0], dtype=dtype)
+        return np.memmap(os.path.join(self.store_dir, name), dtype=dtype, mode='r', shape=(int(size),))
+
+    # Part of the signature, so stores of an older layout are rebuilt
+    FORMAT_VERSION = 2
+
+    @staticmethod
+    def supports(config, augmentation=None):
+        """True if load_image_gt() returns the same sample every time."""
+        return augmentation is None and config.IMAGE_RESIZE_MODE != "crop"
+
+    @staticmethod
+    def signature(dataset, config):
+        """Hash of everything load_image_gt() output depends on."""
+        images = []
+        for info in dataset.image_info:
+            try:
+                stat = os.stat(info["path"])
+                file_version = [stat.st_size, stat.st_mtime_ns]
+            except (OSError, TypeError):
+                file_version = None
+            images.append([str(info["path"]), file_version, str(info.get("label_version", ""))])
+        content = {
+            "format": SampleStore.FORMAT_VERSION,
+            "images": images,
+            # class_ids and the active classes in image_meta depend on the
+            # class names and their mapping, not only on the class count
+            "classes": [[c["source"], c["id"], c["name"]] for c in dataset.class_info],
+            "class_map": sorted((key, int(value)) for key, value in dataset.class_from_source_map.items()),
+            "source_class_ids": sorted((source, [int(i) for i in ids]) for source, ids
+                                       in dataset.source_class_ids.items()),
+            "config": [config.IMAGE_RESIZE_MODE, config.IMAGE_MIN_DIM, config.IMAGE_MAX_DIM,
+                       config.IMAGE_MIN_SCALE, config.USE_MINI_MASK, list(config.MINI_MASK_SHAPE)],
+        }
+        return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_valid(store_dir, signature):
+        try:
+            with open(os.path.join(store_dir, "meta.json"), "r") as f:
+                return json.load(f).get("signature") == signature
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def build(cls, dataset, config, store_dir, signature=None, verbose=1):
+        """Runs load_image_gt() on every image of the dataset and saves the results.
+
+        The store is written to a temporary directory and renamed to
+        store_dir when complete, so readers that have the previous store
+        memory-mapped and other runs building the same store never see
+        partial files.
+        """
+        temp_dir = "{}.{}.{}.tmp".format(store_dir, os.getpid(), threading.get_ident())
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        try:
+            num_images = cls._write(dataset, config, temp_dir, signature)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        cls._publish(temp_dir, store_dir)
+        if verbose:
+            log("Built sample store with {} images at {}".format(num_images, store_dir))
+        return cls(store_dir)
+
+    @classmethod
+    def _write(cls, dataset, config, store_dir, signature=None):
+        image_offsets, image_shapes = [0], []
+        mask_offsets, mask_shapes = [0], []
+        instance_offsets = [0]
+        image_metas, class_ids, bboxes = [], [], []
+        with open(os.path.join(store_dir, "images.raw"), "wb") as images_file, \
+                open(os.path.join(store_dir, "masks.raw"), "wb") as masks_file:
+            for image_id in dataset.image_ids:
+                image, image_meta, gt_class_ids, gt_boxes, gt_masks = \
+                    load_image_gt(dataset, config, image_id)
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+                packed_masks = utils.PackedMasks.from_dense(gt_masks)
+                images_file.write(image.tobytes())
+                masks_file.write(packed_masks.bits.tobytes())
+                image_offsets.append(image_offsets[-1] + image.size)
+                image_shapes.append(image.shape)
+                mask_offsets.append(mask_offsets[-1] + packed_masks.bits.size)
+                mask_shapes.append(packed_masks.shape)
+                instance_offsets.append(instance_offsets[-1] + gt_class_ids.shape[0])
+                image_metas.append(image_meta)
+                class_ids.append(gt_class_ids)
+                bboxes.append(gt_boxes)
+
+        np.savez(os.path.join(store_dir, "index.npz"),
+                 image_offsets=np.array(image_offsets, dtype=np.int64),
+                 image_shapes=np.array(image_shapes, dtype=np.int64).reshape([-1, 3]),
+                 mask_offsets=np.array(mask_offsets, dtype=np.int64),
+                 mask_shapes=np.array(mask_shapes, dtype=np.int64).reshape([-1, 3]),
+                 instance_offsets=np.array(instance_offsets, dtype=np.int64),
+                 image_metas=np.array(image_metas).reshape([len(image_metas), -1]),
+                 class_ids=np.concatenate(class_ids or [np.zeros([0], np.int32)]).astype(np.int32),
+                 bboxes=np.concatenate(bboxes or [np.zeros([0, 4], np.int32)]).astype(np.int32))
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump({"signature": signature or cls.signature(dataset, config),
+                       "num_images": len(image_shapes)}, f)
+        return len(image_shapes)
+
+    @staticmethod
+    def _publish(temp_dir, store_dir):
+        # A directory can't be replaced directly. Move the old one aside
+        # first. Processes that mapped its files keep reading them after
+        # the delete (on Windows the delete fails and is retried by prune()).
+        old_dir = None
+        if os.path.exists(store_dir):
+            old_dir = "{}.{}.{}.old".format(store_dir, os.getpid(), threading.get_ident())
+            try:
+                os.replace(store_dir, old_dir)
+            except OSError:
+                old_dir = None
+        try:
+            os.replace(temp_dir, store_dir)
+        except OSError:
+            # Another run published the same store first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def prune(cls, base_dir, keep):
+        """Deletes all but the keep most recently used stores under base_dir,
+        and old stores left behind by replaced ones."""
+        stores = []
+        for entry in os.scandir(base_dir):
+            if not entry.is_dir():
+                continue
+            if entry.name.endswith(".old"):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            meta_path = os.path.join(entry.path, "meta.json")
+            if re.fullmatch("[0-9a-f]{40}", entry.name) and os.path.exists(meta_path):
+                try:
+                    stores.append((os.stat(meta_path).st_mtime, entry.path))
+                except OSError:
+                    pass
+        stores.sort(reverse=True)
+        for _, store_dir in stores[keep:]:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    @classmethod
+    def open_or_build(cls, dataset, config, base_dir, verbose=1, keep=None):
+        """Returns the store for dataset and config under base_dir, building it if missing or stale.
+
+        keep: Optional. Number of most recently used stores to keep under
+            base_dir. Stores of older signatures are deleted.
+        """
+        signature = cls.signature(dataset, config)
+        store_dir = os.path.join(base_dir, signature)
+        if cls.is_valid(store_dir, signature):
+            try:
+                # Marks the store as recently used for prune()
+                os.utime(os.path.join(store_dir, "meta.json"))
+            except OSError:
+                pass
+            store = cls(store_dir)
+        else:
+            store = cls.build(dataset, config, store_dir, signature, verbose)
+        if keep is not None:
+            cls.prune(base_dir, keep)
+        return store
+
+    def __len__(self):
+        return len(self.image_shapes)
+
+    def load(self, image_id):
+        """Returns the same tuple as load_image_gt() without augmentation,
+        except that the mask is a utils.PackedMasks."""
+        image = self.images[self.image_offsets[image_id]:self.image_offsets[image_id + 1]]
+        mask = self.masks[self.mask_offsets[image_id]:self.mask_offsets[image_id + 1]]
+        instances = slice(self.instance_offsets[image_id], self.instance_offsets[image_id + 1])
+        height, width, count = self.mask_shapes[image_id]
+        return (image.reshape(self.image_shapes[image_id]),
+                self.image_metas[image_id].copy(),
+                self.class_ids[instances].copy(),
+                self.bboxes[instances].copy(),
+                utils.PackedMasks(mask.reshape([count, height, (width + 7) // 8]),
+                                  self.mask_shapes[image_id]))
+
+
 def build_detection_targets(rpn_rois, gt_class_ids, gt_boxes, gt_masks, config):
     """Generate targets for training Stage 2 classifier and mask heads.
     This is not used in normal training. It's useful for debugging or to train
@@ -1348,11 +1576,7 @@ def build_detection_targets(rpn_rois, gt_class_ids, gt_boxes, gt_masks, config):
         (gt_boxes[:, 3] - gt_boxes[:, 1])
 
     # Compute overlaps [rpn_rois, gt_boxes]
-    overlaps = np.zeros((rpn_rois.shape[0], gt_boxes.shape[0]))
-    for i in range(overlaps.shape[1]):
-        gt = gt_boxes[i]
-        overlaps[:, i] = utils.compute_iou(
-            gt, rpn_rois, gt_box_area[i], rpn_roi_area)
+    overlaps = utils.compute_overlaps(rpn_rois, gt_boxes, rpn_roi_area, gt_box_area)
 
     # Assign ROIs to GT boxes
     rpn_roi_iou_argmax = np.argmax(overlaps, axis=1)
@@ -1459,19 +1683,60 @@ def build_detection_targets(rpn_rois, gt_class_ids, gt_boxes, gt_masks, config):
     return rois, roi_gt_class_ids, bboxes, masks
 
 
-def build_rpn_targets(image_shape, anchors, gt_class_ids, gt_boxes, config):
+def _anchor_overlaps(anchors, anchor_areas, boxes):
+    """IoU of every box with every anchor as [boxes, anchors].
+
+    Unlike utils.compute_overlaps() the anchors are the last axis, so each
+    row is contiguous and reductions over boxes are element-wise maximums
+    of a few long rows. Each row is computed in place in reused buffers,
+    with the same operations as utils.compute_iou().
+    """
+    overlaps = np.empty([boxes.shape[0], anchors.shape[0]])
+    if boxes.shape[0] == 0:
+        return overlaps
+    anchor_y1, anchor_x1, anchor_y2, anchor_x2 = [np.ascontiguousarray(c) for c in anchors.T]
+    box_areas = utils.compute_box_areas(boxes)
+    width = np.empty(anchors.shape[0], dtype=overlaps.dtype)
+    height = np.empty_like(width)
+    temp = np.empty_like(width)
+    for i, box in enumerate(boxes):
+        np.minimum(box[3], anchor_x2, out=width)
+        width -= np.maximum(box[1], anchor_x1, out=temp)
+        np.maximum(width, 0, out=width)
+        np.minimum(box[2], anchor_y2, out=height)
+        height -= np.maximum(box[0], anchor_y1, out=temp)
+        np.maximum(height, 0, out=height)
+        # intersection / (box area + anchor areas - intersection)
+        width *= height
+        np.add(box_areas[i], anchor_areas, out=temp)
+        temp -= width
+        np.divide(width, temp, out=overlaps[i])
+    return overlaps
+
+
+def build_rpn_targets(image_shape, anchors, gt_class_ids, gt_boxes, config,
+                      anchor_areas=None, anchor_index=None):
     """Given the anchors and GT boxes, compute overlaps and identify positive
     anchors and deltas to refine them to match their corresponding GT boxes.
 
     anchors: [num_anchors, (y1, x1, y2, x2)]
     gt_class_ids: [num_gt_boxes] Integer class IDs.
     gt_boxes: [num_gt_boxes, (y1, x1, y2, x2)]
+    anchor_areas: Optional. [num_anchors] Precomputed areas of the anchors.
+        The anchors are the same for every image, so callers can compute
+        them once (see compute_box_areas()).
+    anchor_index: Optional. utils.AnchorIndex of the anchors. If given, IoU
+        is only computed for anchors that intersect a GT box; all others
+        have IoU 0 and become negative in bulk.
 
     Returns:
     rpn_match: [N] (int32) matches between anchors and GT boxes.
                1 = positive anchor, -1 = negative anchor, 0 = neutral
     rpn_bbox: [N, (dy, dx, log(dh), log(dw))] Anchor bbox deltas.
     """
+    if anchor_areas is None:
+        anchor_areas = utils.compute_box_areas(anchors)
+
     # RPN Match: 1 = positive anchor, -1 = negative anchor, 0 = neutral
     rpn_match = np.zeros([anchors.shape[0]], dtype=np.int32)
     # RPN bounding boxes: [max anchors per image, (dy, dx, log(dh), log(dw))]
@@ -1487,36 +1752,62 @@ def build_rpn_targets(image_shape, anchors, gt_class_ids, gt_boxes, config):
         crowd_boxes = gt_boxes[crowd_ix]
         gt_class_ids = gt_class_ids[non_crowd_ix]
         gt_boxes = gt_boxes[non_crowd_ix]
-        # Compute overlaps with crowd boxes [anchors, crowds]
-        crowd_overlaps = utils.compute_overlaps(anchors, crowd_boxes)
-        crowd_iou_max = np.amax(crowd_overlaps, axis=1)
-        no_crowd_bool = (crowd_iou_max < 0.001)
+        # Compute overlaps with crowd boxes [crowds, anchors]
+        if anchor_index is not None:
+            crowd_columns = anchor_index.candidates(crowd_boxes)
+            crowd_overlaps = _anchor_overlaps(anchors[crowd_columns], anchor_areas[crowd_columns],
+                                              crowd_boxes)
+            no_crowd_bool = np.ones([anchors.shape[0]], dtype=bool)
+            no_crowd_bool[crowd_columns] = (np.amax(crowd_overlaps, axis=0) < 0.001)
+        else:
+            crowd_overlaps = _anchor_overlaps(anchors, anchor_areas, crowd_boxes)
+            no_crowd_bool = (np.amax(crowd_overlaps, axis=0) < 0.001)
     else:
         # All anchors don't intersect a crowd
-        no_crowd_bool = np.ones([anchors.shape[0]], dtype=bool)
-
-    # Compute overlaps [num_anchors, num_gt_boxes]
-    overlaps = utils.compute_overlaps(anchors, gt_boxes)
-
-    # Match anchors to GT Boxes
-    # If an anchor overlaps a GT box with IoU >= 0.7 then it's positive.
-    # If an anchor overlaps a GT box with IoU < 0.3 then it's negative.
-    # Neutral anchors are those that don't match the conditions above,
-    # and they don't influence the loss function.
-    # However, don't keep any GT box unmatched (rare, but happens). Instead,
-    # match it to the closest anchor (even if its max IoU is < 0.3).
-    #
-    # 1. Set negative anchors first. They get overwritten below if a GT box is
-    # matched to them. Skip boxes in crowd areas.
-    anchor_iou_argmax = np.argmax(overlaps, axis=1)
-    anchor_iou_max = overlaps[np.arange(overlaps.shape[0]), anchor_iou_argmax]
-    rpn_match[(anchor_iou_max < 0.3) & (no_crowd_bool)] = -1
-    # 2. Set an anchor for each GT box (regardless of IoU value).
-    # If multiple anchors have the same IoU match all of them
-    gt_iou_argmax = np.argwhere(overlaps == np.max(overlaps, axis=0))[:,0]
-    rpn_match[gt_iou_argmax] = 1
-    # 3. Set anchors with high overlap as positive.
-    rpn_match[anchor_iou_max >= 0.7] = 1
+        no_crowd_bool = None
+
+    if gt_boxes.shape[0] == 0:
+        # Nothing to match, all anchors outside crowds are negative
+        rpn_match[:] = -1 if no_crowd_bool is None else np.where(no_crowd_bool, -1, 0)
+        overlaps = np.zeros([0, anchors.shape[0]])
+        columns = None
+    else:
+        # Compute overlaps [num_gt_boxes, num_anchors], or only for the
+        # anchor columns that intersect a GT box. The others have IoU 0.
+        columns = None
+        if anchor_index is not None:
+            columns = anchor_index.candidates(gt_boxes)
+            overlaps = _anchor_overlaps(anchors[columns], anchor_areas[columns], gt_boxes)
+            # A GT box without any overlap is matched to every anchor with IoU 0,
+            # which needs the full matrix
+            if columns.shape[0] == 0 or np.any(np.max(overlaps, axis=1) <= 0):
+                columns = None
+        if columns is None:
+            overlaps = _anchor_overlaps(anchors, anchor_areas, gt_boxes)
+            columns = np.arange(anchors.shape[0])
+
+        # Match anchors to GT Boxes
+        # If an anchor overlaps a GT box with IoU >= 0.7 then it's positive.
+        # If an anchor overlaps a GT box with IoU < 0.3 then it's negative.
+        # Neutral anchors are those that don't match the conditions above,
+        # and they don't influence the loss function.
+        # However, don't keep any GT box unmatched (rare, but happens). Instead,
+        # match it to the closest anchor (even if its max IoU is < 0.3).
+        #
+        # 1. Set negative anchors first. They get overwritten below if a GT box is
+        # matched to them. Skip boxes in crowd areas.
+        column_iou_max = np.max(overlaps, axis=0)
+        anchor_iou_max = np.zeros([anchors.shape[0]])
+        anchor_iou_max[columns] = column_iou_max
+        negative = anchor_iou_max < 0.3
+        if no_crowd_bool is not None:
+            negative &= no_crowd_bool
+        rpn_match[negative] = -1
+        # 2. Set an anchor for each GT box (regardless of IoU value).
+        # If multiple anchors have the same IoU match all of them
+        rpn_match[columns[np.any(overlaps == np.max(overlaps, axis=1, keepdims=True), axis=0)]] = 1
+        # 3. Set anchors with high overlap as positive.
+        rpn_match[columns[column_iou_max >= 0.7]] = 1
 
     # Subsample to balance positive and negative anchors
     # Don't let positives be more than half the anchors
@@ -1536,36 +1827,31 @@ def build_rpn_targets(image_shape, anchors, gt_class_ids, gt_boxes, config):
         rpn_match[ids] = 0
 
     # For positive anchors, compute shift and scale needed to transform them
-    # to match the corresponding GT boxes.
+    # to match the corresponding GT boxes. The closest GT box is only looked
+    # up for these few anchors; it might have IoU < 0.7.
     ids = np.where(rpn_match == 1)[0]
-    ix = 0  # index into rpn_bbox
-    # TODO: use box_refinement() rather than duplicating the code here
-    for i, a in zip(ids, anchors[ids]):
-        # Closest gt box (it might have IoU < 0.7)
-        gt = gt_boxes[anchor_iou_argmax[i]]
+    if ids.shape[0] > 0:
+        a = anchors[ids].astype(np.float64)
+        # Positive anchors always have an overlap column
+        gt = gt_boxes[np.argmax(overlaps[:, np.searchsorted(columns, ids)], axis=0)].astype(np.float64)
 
         # Convert coordinates to center plus width/height.
-        # GT Box
-        gt_h = gt[2] - gt[0]
-        gt_w = gt[3] - gt[1]
-        gt_center_y = gt[0] + 0.5 * gt_h
-        gt_center_x = gt[1] + 0.5 * gt_w
-        # Anchor
-        a_h = a[2] - a[0]
-        a_w = a[3] - a[1]
-        a_center_y = a[0] + 0.5 * a_h
-        a_center_x = a[1] + 0.5 * a_w
-
-        # Compute the bbox refinement that the RPN should predict.
-        rpn_bbox[ix] = [
-            (gt_center_y - a_center_y) / a_h,
-            (gt_center_x - a_center_x) / a_w,
-            np.log(gt_h / a_h),
-            np.log(gt_w / a_w),
-        ]
-        # Normalize
-        rpn_bbox[ix] /= config.RPN_BBOX_STD_DEV
-        ix += 1
+        gt_h = gt[:, 2] - gt[:, 0]
+        gt_w = gt[:, 3] - gt[:, 1]
+        gt_center_y = gt[:, 0] + 0.5 * gt_h
+        gt_center_x = gt[:, 1] + 0.5 * gt_w
+        a_h = a[:, 2] - a[:, 0]
+        a_w = a[:, 3] - a[:, 1]
+        a_center_y = a[:, 0] + 0.5 * a_h
+        a_center_x = a[:, 1] + 0.5 * a_w
+
+        # Compute the bbox refinement that the RPN should predict, then normalize
+        deltas = rpn_bbox[:ids.shape[0]]
+        deltas[:, 0] = (gt_center_y - a_center_y) / a_h
+        deltas[:, 1] = (gt_center_x - a_center_x) / a_w
+        deltas[:, 2] = np.log(gt_h / a_h)
+        deltas[:, 3] = np.log(gt_w / a_w)
+        deltas /= config.RPN_BBOX_STD_DEV
 
     return rpn_match, rpn_bbox
 
@@ -1661,6 +1947,15 @@ class DataGenerator(KU.Sequence):
         detection_targets: If True, generate detection targets (class IDs, bbox
             deltas, and masks). Typically for debugging or visualizations because
             in trainig detection targets are generated by DetectionTargetLayer.
+        sample_store: Optional. A SampleStore of this dataset. Samples are read
+            from it instead of calling load_image_gt(). Ignored when
+            augmentation is used.
+        seed: Optional. If given, the sample order of every epoch is derived
+            from (seed, epoch), so separate processes agree on it.
+        buffer_count: Optional. If > 0, batches are written into a ring of
+            this many preallocated buffer sets instead of new arrays. A
+            returned batch is overwritten buffer_count calls later, so the
+            caller must consume or copy it before then.
 
         Returns a Python iterable. Upon calling __getitem__() on it, the
         iterable returns two lists, inputs and outputs. The contents
@@ -1682,9 +1977,9 @@ class DataGenerator(KU.Sequence):
         """
 
     def __init__(self, dataset, config, shuffle=True, augmentation=None,
-                 random_rois=0, detection_targets=False):
+                 random_rois=0, detection_targets=False, sample_store=None, seed=None,
+                 buffer_count=0):
 
-        self.image_ids = np.copy(dataset.image_ids)
         self.dataset = dataset
         self.config = config
 
@@ -1696,31 +1991,80 @@ class DataGenerator(KU.Sequence):
                                                       self.backbone_shapes,
                                                       config.BACKBONE_STRIDES,
                                                       config.RPN_ANCHOR_STRIDE)
+        self.anchor_areas = utils.compute_box_areas(self.anchors)
+        # Grid of the anchors to skip IoU of anchors far from every GT box
+        self.anchor_index = utils.AnchorIndex(self.anchors)
 
         self.shuffle = shuffle
         self.augmentation = augmentation
         self.random_rois = random_rois
         self.batch_size = self.config.BATCH_SIZE
         self.detection_targets = detection_targets
+        self.sample_store = sample_store if SampleStore.supports(config, augmentation) else None
+        self.seed = seed
+        self.set_epoch(0)
+
+        self.set_buffer_count(buffer_count)
+
+    def set_buffer_count(self, buffer_count):
+        """Sets the size of the ring of reusable batch buffers. 0 disables it."""
+        self.buffer_count = buffer_count
+        self.buffers = [None] * buffer_count
+        self.next_buffer = 0
+
+    def set_epoch(self, epoch):
+        """Sets the sample order for the given epoch."""
+        self.epoch = epoch
+        self.image_ids = np.copy(self.dataset.image_ids)
+        if self.shuffle:
+            rng = np.random if self.seed is None else np.random.RandomState([self.seed, epoch])
+            rng.shuffle(self.image_ids)
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
 
     def __len__(self):
         return int(np.ceil(len(self.image_ids) / float(self.batch_size)))
 
+    def _batch_buffers(self, specs):
+        """Returns zeroed arrays for the given {name: (shape, dtype)}, or
+        the next buffer set of the ring if it has matching shapes.
+
+        The "instance_counts" entry records the number of GT instances
+        written to each row, so stale instances of a reused buffer can be
+        cleared without zeroing all of it.
+        """
+        if self.buffer_count:
+            buffers = self.buffers[self.next_buffer]
+            if buffers is not None and all(
+                    name in buffers and buffers[name].shape == tuple(shape)
+                    and buffers[name].dtype == dtype
+                    for name, (shape, dtype) in specs.items()):
+                self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+                return buffers
+        buffers = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+        buffers["instance_counts"] = np.zeros([self.batch_size], dtype=np.int32)
+        if self.buffer_count:
+            self.buffers[self.next_buffer] = buffers
+            self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+        return buffers
+
     def __getitem__(self, idx):
         b = 0
-        image_index = -1
+        image_index = idx * self.batch_size - 1
         while b < self.batch_size:
-            # Increment index to pick next image. Shuffle if at the start of an epoch.
+            # Increment index to pick next image
             image_index = (image_index + 1) % len(self.image_ids)
 
-            if self.shuffle and image_index == 0:
-                np.random.shuffle(self.image_ids)
-
             # Get GT bounding boxes and masks for image.
             image_id = self.image_ids[image_index]
-            image, image_meta, gt_class_ids, gt_boxes, gt_masks = \
-                load_image_gt(self.dataset, self.config, image_id,
-                              augmentation=self.augmentation)
+            if self.sample_store is not None:
+                image, image_meta, gt_class_ids, gt_boxes, gt_masks = \
+                    self.sample_store.load(image_id)
+            else:
+                image, image_meta, gt_class_ids, gt_boxes, gt_masks = \
+                    load_image_gt(self.dataset, self.config, image_id,
+                                  augmentation=self.augmentation)
 
             # Skip images that have no instances. This can happen in cases
             # where we train on a subset of classes and the image doesn't
@@ -1730,7 +2074,9 @@ class DataGenerator(KU.Sequence):
 
             # RPN Targets
             rpn_match, rpn_bbox = build_rpn_targets(image.shape, self.anchors,
-                                                    gt_class_ids, gt_boxes, self.config)
+                                                    gt_class_ids, gt_boxes, self.config,
+                                                    anchor_areas=self.anchor_areas,
+                                                    anchor_index=self.anchor_index)
 
             # Mask R-CNN Targets
             if self.random_rois:
@@ -1743,33 +2089,41 @@ class DataGenerator(KU.Sequence):
 
             # Init batch arrays
             if b == 0:
-                batch_image_meta = np.zeros(
-                    (self.batch_size,) + image_meta.shape, dtype=image_meta.dtype)
-                batch_rpn_match = np.zeros(
-                    [self.batch_size, self.anchors.shape[0], 1], dtype=rpn_match.dtype)
-                batch_rpn_bbox = np.zeros(
-                    [self.batch_size, self.config.RPN_TRAIN_ANCHORS_PER_IMAGE, 4], dtype=rpn_bbox.dtype)
-                batch_images = np.zeros(
-                    (self.batch_size,) + image.shape, dtype=np.float32)
-                batch_gt_class_ids = np.zeros(
-                    (self.batch_size, self.config.MAX_GT_INSTANCES), dtype=np.int32)
-                batch_gt_boxes = np.zeros(
-                    (self.batch_size, self.config.MAX_GT_INSTANCES, 4), dtype=np.int32)
-                batch_gt_masks = np.zeros(
-                    (self.batch_size, gt_masks.shape[0], gt_masks.shape[1],
-                     self.config.MAX_GT_INSTANCES), dtype=gt_masks.dtype)
+                specs = {
+                    "image_meta": ((self.batch_size,) + image_meta.shape, image_meta.dtype),
+                    "rpn_match": ([self.batch_size, self.anchors.shape[0], 1], rpn_match.dtype),
+                    "rpn_bbox": ([self.batch_size, self.config.RPN_TRAIN_ANCHORS_PER_IMAGE, 4],
+                                 rpn_bbox.dtype),
+                    "images": ((self.batch_size,) + image.shape, np.float32),
+                    "gt_class_ids": ((self.batch_size, self.config.MAX_GT_INSTANCES), np.int32),
+                    "gt_boxes": ((self.batch_size, self.config.MAX_GT_INSTANCES, 4), np.int32),
+                    "gt_masks": ((self.batch_size, gt_masks.shape[0], gt_masks.shape[1],
+                                  self.config.MAX_GT_INSTANCES), gt_masks.dtype),
+                }
                 if self.random_rois:
-                    batch_rpn_rois = np.zeros(
-                        (self.batch_size, rpn_rois.shape[0], 4), dtype=rpn_rois.dtype)
+                    specs["rpn_rois"] = ((self.batch_size, rpn_rois.shape[0], 4), rpn_rois.dtype)
                     if self.detection_targets:
-                        batch_rois = np.zeros(
-                            (self.batch_size,) + rois.shape, dtype=rois.dtype)
-                        batch_mrcnn_class_ids = np.zeros(
-                            (self.batch_size,) + mrcnn_class_ids.shape, dtype=mrcnn_class_ids.dtype)
-                        batch_mrcnn_bbox = np.zeros(
-                            (self.batch_size,) + mrcnn_bbox.shape, dtype=mrcnn_bbox.dtype)
-                        batch_mrcnn_mask = np.zeros(
-                            (self.batch_size,) + mrcnn_mask.shape, dtype=mrcnn_mask.dtype)
+                        specs["rois"] = ((self.batch_size,) + rois.shape, rois.dtype)
+                        specs["mrcnn_class_ids"] = ((self.batch_size,) + mrcnn_class_ids.shape,
+                                                    mrcnn_class_ids.dtype)
+                        specs["mrcnn_bbox"] = ((self.batch_size,) + mrcnn_bbox.shape, mrcnn_bbox.dtype)
+                        specs["mrcnn_mask"] = ((self.batch_size,) + mrcnn_mask.shape, mrcnn_mask.dtype)
+                buffers = self._batch_buffers(specs)
+                batch_image_meta = buffers["image_meta"]
+                batch_rpn_match = buffers["rpn_match"]
+                batch_rpn_bbox = buffers["rpn_bbox"]
+                batch_images = buffers["images"]
+                batch_gt_class_ids = buffers["gt_class_ids"]
+                batch_gt_boxes = buffers["gt_boxes"]
+                batch_gt_masks = buffers["gt_masks"]
+                instance_counts = buffers["instance_counts"]
+                if self.random_rois:
+                    batch_rpn_rois = buffers["rpn_rois"]
+                    if self.detection_targets:
+                        batch_rois = buffers["rois"]
+                        batch_mrcnn_class_ids = buffers["mrcnn_class_ids"]
+                        batch_mrcnn_bbox = buffers["mrcnn_bbox"]
+                        batch_mrcnn_mask = buffers["mrcnn_mask"]
 
             # If more instances than fits in the array, sub-sample from them.
             if gt_boxes.shape[0] > self.config.MAX_GT_INSTANCES:
@@ -1779,14 +2133,22 @@ class DataGenerator(KU.Sequence):
                 gt_boxes = gt_boxes[ids]
                 gt_masks = gt_masks[:, :, ids]
 
+            # Clear instances left over from the last use of a reused buffer
+            count = gt_class_ids.shape[0]
+            if instance_counts[b] > count:
+                batch_gt_class_ids[b, count:instance_counts[b]] = 0
+                batch_gt_boxes[b, count:instance_counts[b]] = 0
+                batch_gt_masks[b, :, :, count:instance_counts[b]] = 0
+            instance_counts[b] = count
+
             # Add to batch
             batch_image_meta[b] = image_meta
             batch_rpn_match[b] = rpn_match[:, np.newaxis]
             batch_rpn_bbox[b] = rpn_bbox
-            batch_images[b] = mold_image(image.astype(np.float32), self.config)
-            batch_gt_class_ids[b, :gt_class_ids.shape[0]] = gt_class_ids
-            batch_gt_boxes[b, :gt_boxes.shape[0]] = gt_boxes
-            batch_gt_masks[b, :, :, :gt_masks.shape[-1]] = gt_masks
+            mold_image(image, self.config, out=batch_images[b])
+            batch_gt_class_ids[b, :count] = gt_class_ids
+            batch_gt_boxes[b, :count] = gt_boxes
+            batch_gt_masks[b, :, :, :count] = gt_masks
             if self.random_rois:
                 batch_rpn_rois[b] = rpn_rois
                 if self.detection_targets:
@@ -1813,6 +2175,289 @@ class DataGenerator(KU.Sequence):
         return inputs, outputs
 
 
+def load_rpn_sample(dataset, config, anchors, image_id, augmentation=None, sample_store=None,
+                    anchor_areas=None, anchor_index=None):
+    """Loads one training sample with its RPN targets, padded to the fixed
+    per-image shapes of a training batch.
+
+    Returns None if the image has no instances, otherwise:
+    image: [height, width, 3] Not molded.
+    image_meta: [IMAGE_META_SIZE] float32
+    rpn_match: [anchor count, 1] int32
+    rpn_bbox: [RPN_TRAIN_ANCHORS_PER_IMAGE, 4] float32
+    gt_class_ids: [MAX_GT_INSTANCES] int32
+    gt_boxes: [MAX_GT_INSTANCES, (y1, x1, y2, x2)] float32
+    gt_masks: [height, width, MAX_GT_INSTANCES] bool
+    """
+    if sample_store is not None:
+        image, image_meta, gt_class_ids, gt_boxes, gt_masks = sample_store.load(image_id)
+    else:
+        image, image_meta, gt_class_ids, gt_boxes, gt_masks = \
+            load_image_gt(dataset, config, image_id, augmentation=augmentation)
+
+    # Skip images that have no instances
+    if not np.any(gt_class_ids > 0):
+        return None
+
+    rpn_match, rpn_bbox = build_rpn_targets(image.shape, anchors,
+                                            gt_class_ids, gt_boxes, config,
+                                            anchor_areas=anchor_areas,
+                                            anchor_index=anchor_index)
+
+    # If more instances than fits in the array, sub-sample from them.
+    if gt_boxes.shape[0] > config.MAX_GT_INSTANCES:
+        ids = np.random.choice(
+            np.arange(gt_boxes.shape[0]), config.MAX_GT_INSTANCES, replace=False)
+        gt_class_ids = gt_class_ids[ids]
+        gt_boxes = gt_boxes[ids]
+        gt_masks = gt_masks[:, :, ids]
+
+    count = gt_class_ids.shape[0]
+    padded_class_ids = np.zeros([config.MAX_GT_INSTANCES], dtype=np.int32)
+    padded_class_ids[:count] = gt_class_ids
+    padded_boxes = np.zeros([config.MAX_GT_INSTANCES, 4], dtype=np.float32)
+    padded_boxes[:count] = gt_boxes
+    padded_masks = np.zeros(gt_masks.shape[:2] + (config.MAX_GT_INSTANCES,), dtype=bool)
+    padded_masks[:, :, :count] = gt_masks
+    return (image, image_meta.astype(np.float32),
+            rpn_match[:, np.newaxis].astype(np.int32), rpn_bbox.astype(np.float32),
+            padded_class_ids, padded_boxes, padded_masks)
+
+
+def input_pipeline_caches(config, augmentation=None, cache=None):
+    """Returns the cache arguments of build_input_pipeline() for the training
+    and validation pipelines of MaskRCNN.train().
+
+    Caching is dropped for a pipeline whose samples are not deterministic
+    (augmentation or "crop" resizing). A cache file path gets a "_val"
+    suffix for validation.
+    """
+    train_cache = cache if SampleStore.supports(config, augmentation) else None
+    val_cache = cache if SampleStore.supports(config) else None
+    if isinstance(val_cache, str):
+        val_cache = val_cache + "_val"
+    return train_cache, val_cache
+
+
+def build_input_pipeline(dataset, config, shuffle=True, augmentation=None,
+                         sample_store=None, cache=None, num_parallel_calls=None,
+                         prefetch=None, shuffle_buffer=64, seed=None):
+    """Builds a tf.data pipeline with the same inputs as DataGenerator.
+
+    Samples are loaded by load_image_gt() (or sample_store) and
+    build_rpn_targets() inside tf.numpy_function, num_parallel_calls at a
+    time, and prepared batches are prefetched while the model trains.
+    random_rois and detection_targets of DataGenerator are not supported.
+
+    cache: Optional. True to cache the loaded samples in memory after the
+        first epoch, or a file path to cache them on disk. Only allowed when
+        samples are deterministic (no augmentation, no "crop" resizing).
+        Images are cached before molding, as uint8.
+    num_parallel_calls, prefetch: Defaults to tf.data.experimental.AUTOTUNE.
+
+    Returns a repeating tf.data.Dataset of ((inputs...),) batches for keras fit().
+    """
+    assert not cache or SampleStore.supports(config, augmentation), \
+        "Caching needs deterministic samples (no augmentation or crop resizing)"
+    autotune = tf.data.experimental.AUTOTUNE
+    num_parallel_calls = num_parallel_calls or autotune
+    prefetch = prefetch or autotune
+
+    backbone_shapes = compute_backbone_shapes(config, config.IMAGE_SHAPE)
+    anchors = utils.generate_pyramid_anchors(config.RPN_ANCHOR_SCALES,
+                                             config.RPN_ANCHOR_RATIOS,
+                                             backbone_shapes,
+                                             config.BACKBONE_STRIDES,
+                                             config.RPN_ANCHOR_STRIDE)
+    anchor_areas = utils.compute_box_areas(anchors)
+    anchor_index = utils.AnchorIndex(anchors)
+    if sample_store is not None and not SampleStore.supports(config, augmentation):
+        sample_store = None
+
+    # Static shapes, None where they depend on the image
+    if config.IMAGE_RESIZE_MODE in ["square", "crop"]:
+        image_shape = [int(d) for d in config.IMAGE_SHAPE]
+    else:
+        image_shape = [None, None, int(config.IMAGE_SHAPE[2])]
+    mask_shape = list(config.MINI_MASK_SHAPE) if config.USE_MINI_MASK else image_shape[:2]
+    shapes = [image_shape,
+              [config.IMAGE_META_SIZE],
+              [anchors.shape[0] if image_shape[0] else None, 1],
+              [config.RPN_TRAIN_ANCHORS_PER_IMAGE, 4],
+              [config.MAX_GT_INSTANCES],
+              [config.MAX_GT_INSTANCES, 4],
+              mask_shape + [config.MAX_GT_INSTANCES]]
+    dtypes = [tf.uint8, tf.float32, tf.int32, tf.float32, tf.int32, tf.float32, tf.bool]
+
+    def load(image_id):
+        sample = load_rpn_sample(dataset, config, anchors, int(image_id),
+                                 augmentation=augmentation, sample_store=sample_store,
+                                 anchor_areas=anchor_areas, anchor_index=anchor_index)
+        if sample is None:
+            # Filtered out below, only the shapes have to be valid
+            empty = [np.zeros([d or 1 for d in shape], dtype=dtype.as_numpy_dtype)
+                     for shape, dtype in zip(shapes, dtypes)]
+            return [np.array(False)] + empty
+        image = np.clip(sample[0], 0, 255).astype(np.uint8)
+        return [np.array(True), image] + list(sample[1:])
+
+    def load_tensors(image_id):
+        tensors = tf.numpy_function(load, [image_id], [tf.bool] + dtypes)
+        valid, tensors = tensors[0], tensors[1:]
+        valid.set_shape([])
+        for tensor, shape in zip(tensors, shapes):
+            tensor.set_shape(shape)
+        return (valid,) + tuple(tensors)
+
+    def mold(image, *targets):
+        image = tf.cast(image, tf.float32) - tf.constant(config.MEAN_PIXEL, dtype=tf.float32)
+        return (image,) + targets
+
+    image_ids = np.copy(dataset.image_ids).astype(np.int64)
+    pipeline = tf.data.Dataset.from_tensor_slices(image_ids)
+    if shuffle and not cache:
+        pipeline = pipeline.shuffle(len(image_ids), seed=seed, reshuffle_each_iteration=True)
+    pipeline = pipeline.map(load_tensors, num_parallel_calls=num_parallel_calls)
+    pipeline = pipeline.filter(lambda valid, *sample: valid)
+    pipeline = pipeline.map(lambda valid, *sample: sample)
+    if cache:
+        pipeline = pipeline.cache("" if cache is True else cache)
+        if shuffle:
+            pipeline = pipeline.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    pipeline = pipeline.repeat()
+    pipeline = pipeline.map(mold, num_parallel_calls=num_parallel_calls)
+    pipeline = pipeline.batch(config.BATCH_SIZE, drop_remainder=True)
+    pipeline = pipeline.map(lambda *inputs: (inputs,))
+    return pipeline.prefetch(prefetch)
+
+
+# Per-process state of BatchPrefetcher workers
+_worker_generator = None
+_worker_slots = None
+_worker_layout = None
+
+
+def _init_prefetch_worker(generator, slot_names, layout):
+    global _worker_generator, _worker_slots, _worker_layout
+    from multiprocessing import shared_memory
+    _worker_generator = generator
+    # Each batch is copied into a shared slot right away, one buffer set is enough
+    _worker_generator.set_buffer_count(1)
+    _worker_slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    _worker_layout = layout
+
+
+def _seed_batch(generator, seed, epoch, idx):
+    """Seeds the random generators for one batch. The seed depends only on
+    (seed, epoch, idx), so results don't depend on which worker runs it."""
+    np.random.seed([seed, epoch, idx])
+    if generator.augmentation is not None:
+        import imgaug
+        imgaug.seed(np.random.randint(0, 2 ** 31 - 1))
+
+
+def _slot_arrays(buffer, layout):
+    return [np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for offset, shape, dtype in layout]
+
+
+def _prefetch_batch(task):
+    step, slot, seed = task
+    generator = _worker_generator
+    epoch, idx = divmod(step, len(generator))
+    if generator.epoch != epoch:
+        generator.set_epoch(epoch)
+    _seed_batch(generator, seed, epoch, idx)
+    inputs, outputs = generator[idx]
+    arrays = inputs + outputs
+    if [(a.shape, a.dtype.str) for a in arrays] != [(l[1], l[2]) for l in _worker_layout]:
+        # Shapes differ from the first batch (e.g. "pad64" resizing), send the arrays instead
+        return step, slot, (inputs, outputs)
+    for target, array in zip(_slot_arrays(_worker_slots[slot].buf, _worker_layout), arrays):
+        target[...] = array
+    return step, slot, None
+
+
+class BatchPrefetcher(object):
+    """Prepares the batches of a DataGenerator in a pool of worker processes.
+
+    Workers write each batch into one of `prefetch` shared memory slots, so
+    large arrays are not pickled through pipes, and at most `prefetch`
+    batches are prepared ahead of the training loop. Batches are returned in
+    order. Every batch is seeded from (seed, epoch, index), so the output is
+    the same for any number of workers.
+
+    Iterating returns an endless generator of (inputs, outputs) tuples, as
+    expected by keras fit().
+    """
+
+    def __init__(self, generator, workers, prefetch=8, seed=None):
+        assert workers > 0, "Use the DataGenerator directly without workers"
+        self.generator = generator
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.seed = np.random.randint(0, 2 ** 31 - 1) if seed is None else seed
+        generator.seed = self.seed
+        generator.set_epoch(0)
+        self.pool = None
+        self.slots = []
+        self.layout = None
+
+    def _start(self, arrays):
+        from multiprocessing import shared_memory
+        layout = []
+        offset = 0
+        for array in arrays:
+            layout.append((offset, array.shape, array.dtype.str))
+            # Keep every array 64-byte aligned
+            offset += (array.nbytes + 63) // 64 * 64
+        self.layout = layout
+        self.slots = [shared_memory.SharedMemory(create=True, size=max(offset, 1))
+                      for _ in range(self.prefetch)]
+        self.pool = multiprocessing.Pool(
+            self.workers, initializer=_init_prefetch_worker,
+            initargs=(self.generator, [slot.name for slot in self.slots], layout))
+
+    def __iter__(self):
+        # The first batch is made here to learn the shapes of the batch arrays
+        _seed_batch(self.generator, self.seed, 0, 0)
+        inputs, outputs = self.generator[0]
+        self._start(inputs + outputs)
+        yield inputs, outputs
+
+        num_inputs = len(inputs)
+        free_slots = list(range(self.prefetch))
+        pending = {}
+        next_step = 1
+        step = 1
+        while True:
+            while free_slots:
+                task = (next_step, free_slots.pop(), self.seed)
+                pending[next_step] = self.pool.apply_async(_prefetch_batch, (task,))
+                next_step += 1
+            _, slot, batch = pending.pop(step).get()
+            if batch is None:
+                # Copy out of the slot, keras may hold on to the arrays
+                arrays = [a.copy() for a in _slot_arrays(self.slots[slot].buf, self.layout)]
+                batch = arrays[:num_inputs], arrays[num_inputs:]
+            free_slots.append(slot)
+            step += 1
+            yield batch
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
+
+    def __del__(self):
+        self.close()
+
+
 ############################################################
 #  MaskRCNN-Train Class
 ############################################################
@@ -2274,7 +2919,8 @@ class MaskRCNN(object):
             "*epoch*", "{epoch:04d}")
 
     def train(self, train_dataset, val_dataset, learning_rate, epochs, layers,
-              augmentation=None, custom_callbacks=None, no_augmentation_sources=None):
+              augmentation=None, custom_callbacks=None, no_augmentation_sources=None,
+              use_tf_data=False, tf_data_cache=None):
         """Train the model.
         train_dataset, val_dataset: Training and validation Dataset objects.
         learning_rate: The learning rate to train with
@@ -2306,6 +2952,12 @@ class MaskRCNN(object):
         no_augmentation_sources: Optional. List of sources to exclude for
             augmentation. A source is string that identifies a dataset and is
             defined in the Dataset class.
+        use_tf_data: If True, feed the model from build_input_pipeline()
+            instead of DataGenerator and the worker pool.
+        tf_data_cache: Optional. With use_tf_data, cache the loaded samples
+            in memory (True) or in files at this path. The validation cache
+            gets a "_val" suffix. Ignored where the samples are not
+            deterministic (augmentation or "crop" resizing).
         """
         assert self.mode == "training", "Create model in training mode."
 
@@ -2323,10 +2975,24 @@ class MaskRCNN(object):
         if layers in layer_regex.keys():
             layers = layer_regex[layers]
 
+        # Pre-resized samples, built once and reused by every epoch
+        train_store = val_store = None
+        if self.config.SAMPLE_STORE_DIR:
+            if SampleStore.supports(self.config, augmentation):
+                train_store = SampleStore.open_or_build(train_dataset, self.config,
+                                                        self.config.SAMPLE_STORE_DIR,
+                                                        keep=self.config.SAMPLE_STORE_KEEP)
+            if SampleStore.supports(self.config):
+                val_store = SampleStore.open_or_build(val_dataset, self.config,
+                                                      self.config.SAMPLE_STORE_DIR,
+                                                      keep=self.config.SAMPLE_STORE_KEEP)
+
         # Data generators
         train_generator = DataGenerator(train_dataset, self.config, shuffle=True,
-                                        augmentation=augmentation)
-        val_generator = DataGenerator(val_dataset, self.config, shuffle=True)
+                                        augmentation=augmentation, sample_store=train_store,
+                                        seed=self.config.DATA_SEED)
+        val_generator = DataGenerator(val_dataset, self.config, shuffle=True,
+                                      sample_store=val_store, seed=self.config.DATA_SEED)
 
         # Create log_dir if it does not exist
         if not os.path.exists(self.log_dir):
@@ -2355,21 +3021,48 @@ class MaskRCNN(object):
         # https://github.com/matterport/Mask_RCNN/issues/13#issuecomment-353124009
         if os.name == 'nt':
             workers = 0
+        elif self.config.DATA_WORKERS is None:
+            workers = min(4, multiprocessing.cpu_count())
+        else:
+            workers = self.config.DATA_WORKERS
+
+        # Batches are prepared by our own worker pool, keras only reads them
+        prefetchers = []
+        if use_tf_data:
+            train_cache, val_cache = input_pipeline_caches(self.config, augmentation, tf_data_cache)
+            train_data = build_input_pipeline(
+                train_dataset, self.config, shuffle=True, augmentation=augmentation,
+                sample_store=train_store, cache=train_cache, seed=self.config.DATA_SEED)
+            val_data = build_input_pipeline(
+                val_dataset, self.config, shuffle=True, sample_store=val_store,
+                cache=val_cache, seed=self.config.DATA_SEED)
+        elif workers > 0:
+            # Validation runs far fewer steps than training and gets a smaller pool
+            prefetchers = [BatchPrefetcher(generator, generator_workers, self.config.DATA_PREFETCH,
+                                           self.config.DATA_SEED)
+                           for generator, generator_workers in ((train_generator, workers),
+                                                                (val_generator, max(1, workers // 4)))]
+            train_data, val_data = [iter(prefetcher) for prefetcher in prefetchers]
         else:
-            workers = multiprocessing.cpu_count()
-
-        self.keras_model.fit(
-            train_generator,
-            initial_epoch=self.epoch,
-            epochs=epochs,
-            steps_per_epoch=self.config.STEPS_PER_EPOCH,
-            callbacks=callbacks,
-            validation_data=val_generator,
-            validation_steps=self.config.VALIDATION_STEPS,
-            max_queue_size=100,
-            workers=1,
-            use_multiprocessing=False,
-        )
+            train_data, val_data = train_generator, val_generator
+
+        try:
+            self.keras_model.fit(
+                train_data,
+                initial_epoch=self.epoch,
+                epochs=epochs,
+                steps_per_epoch=self.config.STEPS_PER_EPOCH,
+                callbacks=callbacks,
+                validation_data=val_data,
+                validation_steps=self.config.VALIDATION_STEPS,
+                # Bounded like the worker slots, not 100 batches deep
+                max_queue_size=self.config.DATA_PREFETCH,
+                workers=1,
+                use_multiprocessing=False,
+            )
+        finally:
+            for prefetcher in prefetchers:
+                prefetcher.close()
         self.epoch = max(self.epoch, epochs)
 
     def mold_inputs(self, images):
@@ -2412,7 +3105,7 @@ class MaskRCNN(object):
         return molded_images, image_metas, windows
 
     def unmold_detections(self, detections, mrcnn_mask, original_image_shape,
-                          image_shape, window):
+                          image_shape, window, packed_masks=False):
         """Reformats the detections of one image from the format of the neural
         network output to a format suitable for use in the rest of the
         application.
@@ -2423,6 +3116,8 @@ class MaskRCNN(object):
         image_shape: [H, W, C] Shape of the image after resizing and padding
         window: [y1, x1, y2, x2] Pixel coordinates of box in the image where the real
                 image is excluding the padding.
+        packed_masks: If True, return the masks as utils.PackedMasks, packing
+                each mask as soon as it's unmolded.
 
         Returns:
         boxes: [N, (y1, x1, y2, x2)] Bounding boxes in pixels
@@ -2466,6 +3161,11 @@ class MaskRCNN(object):
             N = class_ids.shape[0]
 
         # Resize masks to original image size and set boundary threshold.
+        if packed_masks:
+            full_masks = utils.PackedMasks.stack(
+                (utils.unmold_mask(masks[i], boxes[i], original_image_shape) for i in range(N)),
+                original_image_shape[:2])
+            return boxes, class_ids, scores, full_masks
         full_masks = []
         for i in range(N):
             # Convert neural network mask to full size mask
@@ -2476,10 +3176,11 @@ class MaskRCNN(object):
 
         return boxes, class_ids, scores, full_masks
 
-    def detect(self, images, verbose=0):
+    def detect(self, images, verbose=0, packed_masks=False):
         """Runs the detection pipeline.
 
         images: List of images, potentially of different sizes.
+        packed_masks: If True, masks are returned as utils.PackedMasks.
 
         Returns a list of dicts, one dict per image. The dict contains:
         rois: [N, (y1, x1, y2, x2)] detection bounding boxes
@@ -2525,7 +3226,7 @@ class MaskRCNN(object):
             final_rois, final_class_ids, final_scores, final_masks =\
                 self.unmold_detections(detections[i], mrcnn_mask[i],
                                        image.shape, molded_images[i].shape,
-                                       windows[i])
+                                       windows[i], packed_masks=packed_masks)
             results.append({
                 "rois": final_rois,
                 "class_ids": final_class_ids,
@@ -2792,12 +3493,18 @@ def parse_image_meta_graph(meta):
     }
 
 
-def mold_image(images, config):
+def mold_image(images, config, out=None):
     """Expects an RGB image (or array of images) and subtracts
     the mean pixel and converts it to float. Expects image
     colors in RGB order.
+
+    out: Optional. A float32 array of the same shape to write the result
+        into, instead of allocating a new one.
     """
-    return images.astype(np.float32) - config.MEAN_PIXEL
+    if out is None:
+        return images.astype(np.float32) - config.MEAN_PIXEL
+    np.subtract(images, config.MEAN_PIXEL, out=out, casting="unsafe")
+    return out
 
 
 def unmold_image(normalized_images, config):
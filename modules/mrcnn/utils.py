@@ -7,6 +7,7 @@ Licensed under the MIT License (see LICENSE for details)
 Written by Waleed Abdulla
 """
 
+import hashlib
 import logging
 import math
 import numpy as np
@@ -19,8 +20,10 @@ import skimage.io
 import skimage.transform
 import sys
 import tensorflow as tf
+import threading
 import urllib.request
 import warnings
+from collections import OrderedDict
 from distutils.version import LooseVersion
 
 # URL from which to download the latest COCO trained weights
@@ -34,27 +37,42 @@ COCO_MODEL_URL = "https://github.com/matterport/Mask_RCNN/releases/download/v2.0
 def extract_bboxes(mask):
     """Compute bounding boxes from masks.
     mask: [height, width, num_instances]. Mask pixels are either 1 or 0.
+        PackedMasks and RLEMasks are supported without unpacking them.
 
     Returns: bbox array [num_instances, (y1, x1, y2, x2)].
     """
-    boxes = np.zeros([mask.shape[-1], 4], dtype=np.int32)
-    for i in range(mask.shape[-1]):
-        m = mask[:, :, i]
-        # Bounding box.
-        horizontal_indicies = np.where(np.any(m, axis=0))[0]
-        vertical_indicies = np.where(np.any(m, axis=1))[0]
-        if horizontal_indicies.shape[0]:
-            x1, x2 = horizontal_indicies[[0, -1]]
-            y1, y2 = vertical_indicies[[0, -1]]
-            # x2 and y2 should not be part of the box. Increment by 1.
-            x2 += 1
-            y2 += 1
-        else:
-            # No mask for this instance. Might happen due to
-            # resizing or cropping. Set bbox to zeros
-            x1, x2, y1, y2 = 0, 0, 0, 0
-        boxes[i] = np.array([y1, x1, y2, x2])
-    return boxes.astype(np.int32)
+    if isinstance(mask, (PackedMasks, RLEMasks)):
+        return mask.bboxes()
+    height, width, count = mask.shape
+    boxes = np.zeros([count, 4], dtype=np.int32)
+    if count == 0 or height == 0 or width == 0:
+        return boxes
+    # Rows and columns each instance covers [height/width, instances]
+    horizontal = np.any(mask, axis=0)
+    if 1 < count < 64:
+        # Reducing the width axis with few instances innermost is slow in
+        # numpy, so fold the width in halves with element-wise ORs instead
+        vertical = mask.astype(bool, copy=False)
+        while vertical.shape[1] > 1:
+            half = vertical.shape[1] // 2
+            folded = vertical[:, :half] | vertical[:, half:2 * half]
+            if vertical.shape[1] % 2:
+                folded[:, 0] |= vertical[:, -1]
+            vertical = folded
+        vertical = vertical[:, 0]
+    else:
+        vertical = np.any(mask, axis=1)
+    # No mask for an instance might happen due to resizing or cropping.
+    # Its bbox stays zeros
+    ids = np.where(horizontal.any(axis=0))[0]
+    horizontal = horizontal[:, ids]
+    vertical = vertical[:, ids]
+    boxes[ids, 0] = np.argmax(vertical, axis=0)
+    boxes[ids, 1] = np.argmax(horizontal, axis=0)
+    # x2 and y2 should not be part of the box
+    boxes[ids, 2] = height - np.argmax(vertical[::-1], axis=0)
+    boxes[ids, 3] = width - np.argmax(horizontal[::-1], axis=0)
+    return boxes
 
 
 def compute_iou(box, boxes, box_area, boxes_area):
@@ -78,45 +96,71 @@ def compute_iou(box, boxes, box_area, boxes_area):
     return iou
 
 
-def compute_overlaps(boxes1, boxes2):
+def compute_box_areas(boxes):
+    """Computes the areas of boxes [N, (y1, x1, y2, x2)]."""
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def compute_overlaps(boxes1, boxes2, area1=None, area2=None, block_size=1 << 16, dtype=np.float64):
     """Computes IoU overlaps between two sets of boxes.
     boxes1, boxes2: [N, (y1, x1, y2, x2)].
+    area1, area2: Optional. Precomputed areas of the boxes, e.g. of anchors
+        that are reused for every image.
+    block_size: Max number of IoU values computed at once. Rows of boxes1
+        are processed in blocks of this size to cap the temporary memory,
+        e.g. for all anchors against many GT boxes. None for a single pass.
+    dtype: dtype of the returned matrix. Pass float32 boxes, areas and
+        dtype to halve the memory of large matrices.
 
     For better performance, pass the largest set first and the smaller second.
     """
     # Areas of anchors and GT boxes
-    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
-    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    if area1 is None:
+        area1 = compute_box_areas(boxes1)
+    if area2 is None:
+        area2 = compute_box_areas(boxes2)
 
     # Compute overlaps to generate matrix [boxes1 count, boxes2 count]
     # Each cell contains the IoU value.
-    overlaps = np.zeros((boxes1.shape[0], boxes2.shape[0]))
-    for i in range(overlaps.shape[1]):
-        box2 = boxes2[i]
-        overlaps[:, i] = compute_iou(box2, boxes1, area2[i], area1)
+    overlaps = np.empty((boxes1.shape[0], boxes2.shape[0]), dtype=dtype)
+    if overlaps.size == 0:
+        return overlaps
+    rows = boxes1.shape[0] if block_size is None else max(1, block_size // boxes2.shape[0])
+    for start in range(0, boxes1.shape[0], rows):
+        block = boxes1[start:start + rows, None, :]
+        # Same operations as compute_iou(), broadcast to [rows, boxes2 count]
+        height = np.minimum(block[..., 2], boxes2[:, 2])
+        height -= np.maximum(block[..., 0], boxes2[:, 0])
+        np.maximum(height, 0, out=height)
+        width = np.minimum(block[..., 3], boxes2[:, 3])
+        width -= np.maximum(block[..., 1], boxes2[:, 1])
+        np.maximum(width, 0, out=width)
+        intersection = np.multiply(width, height, out=width)
+        union = area2 + area1[start:start + rows, None] - intersection
+        np.divide(intersection, union, out=overlaps[start:start + rows], casting="unsafe")
     return overlaps
 
 
 def compute_overlaps_masks(masks1, masks2):
     """Computes IoU overlaps between two sets of masks.
-    masks1, masks2: [Height, Width, instances]
+    masks1, masks2: [Height, Width, instances], PackedMasks or RLEMasks
+
+    Dense masks are run-length encoded, so the work scales with the mask
+    outlines instead of the image area, and only pairs with overlapping
+    bounding boxes are intersected.
     """
 
     # If either set of masks is empty return empty result
     if masks1.shape[-1] == 0 or masks2.shape[-1] == 0:
         return np.zeros((masks1.shape[-1], masks2.shape[-1]))
-    # flatten masks and compute their areas
-    masks1 = np.reshape(masks1 > .5, (-1, masks1.shape[-1])).astype(np.float32)
-    masks2 = np.reshape(masks2 > .5, (-1, masks2.shape[-1])).astype(np.float32)
-    area1 = np.sum(masks1, axis=0)
-    area2 = np.sum(masks2, axis=0)
-
-    # intersections and union
-    intersections = np.dot(masks1.T, masks2)
-    union = area1[:, None] + area2[None, :] - intersections
-    overlaps = intersections / union
-
-    return overlaps
+    # Packed masks are intersected without unpacking them
+    if isinstance(masks1, PackedMasks) and isinstance(masks2, PackedMasks):
+        return masks1.iou(masks2)
+    if not isinstance(masks1, RLEMasks):
+        masks1 = RLEMasks.from_dense(np.asarray(masks1) > .5)
+    if not isinstance(masks2, RLEMasks):
+        masks2 = RLEMasks.from_dense(np.asarray(masks2) > .5)
+    return masks1.iou(masks2)
 
 
 def non_max_suppression(boxes, scores, threshold):
@@ -124,36 +168,151 @@ def non_max_suppression(boxes, scores, threshold):
     boxes: [N, (y1, x1, y2, x2)]. Notice that (y2, x2) lays outside the box.
     scores: 1-D array of box scores.
     threshold: Float. IoU threshold to use for filtering.
+
+    Uses non_max_suppression_matrix() for up to 256 boxes and
+    non_max_suppression_tiled() for more. Both keep the same boxes.
     """
+    if boxes.shape[0] <= 256:
+        return non_max_suppression_matrix(boxes, scores, threshold)
+    return non_max_suppression_tiled(boxes, scores, threshold)
+
+
+def _sort_boxes_by_score(boxes, scores):
+    """Returns the boxes sorted by score (highest first), their areas and
+    the sort order."""
     assert boxes.shape[0] > 0
     if boxes.dtype.kind != "f":
         boxes = boxes.astype(np.float32)
+    ixs = scores.argsort()[::-1]
+    boxes = boxes[ixs]
+    return boxes, compute_box_areas(boxes), ixs
 
-    # Compute box areas
-    y1 = boxes[:, 0]
-    x1 = boxes[:, 1]
-    y2 = boxes[:, 2]
-    x2 = boxes[:, 3]
-    area = (y2 - y1) * (x2 - x1)
 
-    # Get indicies of boxes sorted by scores (highest first)
-    ixs = scores.argsort()[::-1]
+def non_max_suppression_matrix(boxes, scores, threshold):
+    """Non-maximum suppression with the IoU of all box pairs computed at
+    once. Needs [N, N] memory and time, and is only faster than
+    non_max_suppression_tiled() for small inputs. non_max_suppression()
+    uses it for up to 256 boxes. Same arguments and result as
+    non_max_suppression().
+    """
+    boxes, area, ixs = _sort_boxes_by_score(boxes, scores)
+    # IoU in the dtype of the boxes so the threshold compares the same way
+    # as compute_iou() results
+    overlapped = compute_overlaps(boxes, boxes, area, area,
+                                  block_size=None, dtype=boxes.dtype) > threshold
+
+    pick = []
+    removed = np.zeros([boxes.shape[0]], dtype=bool)
+    for i in range(boxes.shape[0]):
+        if removed[i]:
+            continue
+        pick.append(i)
+        removed |= overlapped[i]
+    return ixs[pick].astype(np.int32)
+
+
+def non_max_suppression_tiled(boxes, scores, threshold, tile_size=64, block_size=16384):
+    """Non-maximum suppression for many boxes, processed in tiles of the
+    highest scored remaining boxes. Each tile is suppressed greedily with
+    its IoU matrix packed as a bitmask, then the boxes kept from it remove
+    all overlapped boxes from the rest at once, block_size boxes at a time.
+    Small tiles let kept boxes prune the rest early. Same arguments and
+    result as non_max_suppression().
+    """
+    boxes, area, ixs = _sort_boxes_by_score(boxes, scores)
 
+    pick = []
+    # Positions (in score order) of boxes not yet kept or removed
+    rest = np.arange(boxes.shape[0])
+    while len(rest) > 0:
+        tile = rest[:tile_size]
+        rest = rest[tile_size:]
+
+        # Greedy suppression within the tile. Row i of the bitmask marks
+        # the boxes of the tile that box i overlaps.
+        overlapped = np.packbits(compute_overlaps(boxes[tile], boxes[tile], area[tile], area[tile],
+                                                  block_size=None, dtype=boxes.dtype) > threshold,
+                                 axis=1)
+        removed = np.zeros_like(overlapped[0])
+        kept = []
+        for i in range(len(tile)):
+            if removed[i >> 3] & (0x80 >> (i & 7)):
+                continue
+            kept.append(tile[i])
+            removed |= overlapped[i]
+        pick.extend(kept)
+
+        # Remove boxes overlapped by any kept box, in blocks to bound the memory
+        keep_rest = np.ones([len(rest)], dtype=bool)
+        for block_start in range(0, len(rest), block_size):
+            block = rest[block_start:block_start + block_size]
+            keep_rest[block_start:block_start + block_size] = ~np.any(
+                compute_overlaps(boxes[block], boxes[kept], area[block], area[kept],
+                                 block_size=None, dtype=boxes.dtype) > threshold, axis=1)
+        rest = rest[keep_rest]
+    return ixs[pick].astype(np.int32)
+
+
+def soft_non_max_suppression(boxes, scores, threshold=0.3, sigma=0.5,
+                             score_threshold=0.001, method="gaussian"):
+    """Soft-NMS (Bodla et al., 2017). Instead of removing the boxes that
+    overlap a picked box, their scores are decayed by the IoU and boxes are
+    only dropped once their score is below score_threshold.
+    boxes: [N, (y1, x1, y2, x2)]. Notice that (y2, x2) lays outside the box.
+    scores: 1-D array of box scores.
+    threshold: Float. IoU above which scores are decayed with method "linear".
+    sigma: Float. Spread of the decay with method "gaussian".
+    score_threshold: Float. Boxes with a lower decayed score are dropped.
+    method: "linear" multiplies the score by (1 - IoU) when IoU > threshold.
+        "gaussian" multiplies it by exp(-IoU^2 / sigma).
+
+    Returns: indices of kept boxes in the order they were picked and their
+    decayed scores.
+    """
+    assert method in ["linear", "gaussian"]
+    assert boxes.shape[0] > 0
+    if boxes.dtype.kind != "f":
+        boxes = boxes.astype(np.float32)
+    area = compute_box_areas(boxes)
+    scores = scores.astype(np.float32)
+
+    ixs = np.arange(boxes.shape[0])
     pick = []
     while len(ixs) > 0:
-        # Pick top box and add its index to the list
-        i = ixs[0]
+        # Pick the box with the highest decayed score
+        top = np.argmax(scores[ixs])
+        i = ixs[top]
         pick.append(i)
-        # Compute IoU of the picked box with the rest
-        iou = compute_iou(boxes[i], boxes[ixs[1:]], area[i], area[ixs[1:]])
-        # Identify boxes with IoU over the threshold. This
-        # returns indices into ixs[1:], so add 1 to get
-        # indices into ixs.
-        remove_ixs = np.where(iou > threshold)[0] + 1
-        # Remove indices of the picked and overlapped boxes.
-        ixs = np.delete(ixs, remove_ixs)
-        ixs = np.delete(ixs, 0)
-    return np.array(pick, dtype=np.int32)
+        ixs = np.delete(ixs, top)
+        if len(ixs) == 0:
+            break
+        # Decay the scores of the rest by their IoU with the picked box
+        iou = compute_iou(boxes[i], boxes[ixs], area[i], area[ixs])
+        if method == "linear":
+            scores[ixs] *= np.where(iou > threshold, 1 - iou, 1)
+        else:
+            scores[ixs] *= np.exp(-(iou * iou) / sigma)
+        ixs = ixs[scores[ixs] >= score_threshold]
+    pick = np.array(pick, dtype=np.int32)
+    return pick, scores[pick]
+
+
+def batched_non_max_suppression(boxes, scores, class_ids, threshold):
+    """Performs non-maximum suppression separately for each class, so boxes
+    of different classes never suppress each other.
+    boxes: [N, (y1, x1, y2, x2)]. Notice that (y2, x2) lays outside the box.
+    scores: 1-D array of box scores.
+    class_ids: 1-D array of box class IDs.
+    threshold: Float. IoU threshold to use for filtering.
+
+    Returns: indices of kept boxes of all classes, sorted by score (highest first).
+    """
+    keep = [np.zeros([0], dtype=np.int32)]
+    for class_id in np.unique(class_ids):
+        ixs = np.where(class_ids == class_id)[0]
+        keep.append(ixs[non_max_suppression(boxes[ixs], scores[ixs], threshold)])
+    keep = np.concatenate(keep)
+    return keep[np.argsort(-scores[keep], kind="stable")].astype(np.int32)
 
 
 def apply_box_deltas(boxes, deltas):
@@ -232,10 +391,420 @@ def box_refinement(box, gt_box):
     return np.stack([dy, dx, dh, dw], axis=1)
 
 
+############################################################
+#  Packed Masks
+############################################################
+
+# Number of set bits of each byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _instance_key(key):
+    """Reduces masks[ids], masks[..., ids] and masks[:, :, ids] to ids.
+    Indexing other axes of packed or RLE masks isn't supported."""
+    if isinstance(key, tuple):
+        if len(key) == 2 and key[0] is Ellipsis:
+            return key[1]
+        if len(key) == 3 and all(isinstance(k, slice) and k == slice(None) for k in key[:2]):
+            return key[2]
+        raise IndexError("Only the instance axis of packed masks can be indexed")
+    return key
+
+
+class PackedMasks(object):
+    """Instance masks packed to 1 bit per pixel with np.packbits along the
+    width. Stands in for a dense [height, width, instances] bool array at
+    1/8 of the memory: it has the same shape and dtype, supports selecting
+    instances with masks[..., ids] or masks[:, :, ids], and converts to the
+    dense array wherever numpy needs one (e.g. np.asarray(masks)).
+
+    bits: [instances, height, ceil(width / 8)] uint8
+    shape: (height, width, instances) of the dense masks.
+
+    Area, bounding boxes, intersection and union are computed on the
+    packed bits without unpacking them.
+    """
+
+    dtype = np.dtype(np.bool_)
+    ndim = 3
+
+    def __init__(self, bits, shape):
+        assert bits.shape[0] == shape[2] and bits.shape[1] == shape[0]
+        self.bits = bits
+        self.shape = tuple(int(d) for d in shape)
+
+    @classmethod
+    def from_dense(cls, mask):
+        """Packs a [height, width, instances] mask. Non-zero pixels are set."""
+        mask = np.moveaxis(mask.astype(bool, copy=False), -1, 0)
+        return cls(np.packbits(mask, axis=2), mask.shape[1:] + mask.shape[:1])
+
+    @classmethod
+    def stack(cls, masks, shape):
+        """Packs a list of [height, width] masks one at a time, so only one
+        dense mask is in memory. shape: (height, width) of the masks."""
+        bits = [np.packbits(m.astype(bool, copy=False), axis=1) for m in masks]
+        bits = np.stack(bits) if bits else np.zeros([0, shape[0], (shape[1] + 7) // 8], dtype=np.uint8)
+        return cls(bits, tuple(shape[:2]) + (len(bits),))
+
+    def to_dense(self):
+        """Returns the [height, width, instances] bool mask."""
+        mask = np.unpackbits(self.bits, axis=2, count=self.shape[1]).view(np.bool_)
+        return np.ascontiguousarray(np.moveaxis(mask, 0, -1))
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.to_dense()
+        return mask if dtype is None else mask.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __getitem__(self, key):
+        # An integer index returns the dense 2D mask
+        key = _instance_key(key)
+        if isinstance(key, (int, np.integer)):
+            return np.unpackbits(self.bits[key], axis=1, count=self.shape[1]).view(np.bool_)
+        bits = self.bits[key]
+        return PackedMasks(bits, self.shape[:2] + (bits.shape[0],))
+
+    def area(self):
+        """Returns the number of pixels of each instance [instances]."""
+        return _POPCOUNT[self.bits].sum(axis=(1, 2), dtype=np.int64)
+
+    def bboxes(self):
+        """Returns the bounding boxes [instances, (y1, x1, y2, x2)] like
+        extract_bboxes(). Empty masks get all zero boxes."""
+        height, width, count = self.shape
+        boxes = np.zeros([count, 4], dtype=np.int32)
+        if count == 0 or height == 0 or width == 0:
+            return boxes
+        rows = np.any(self.bits, axis=2)
+        columns = np.unpackbits(np.bitwise_or.reduce(self.bits, axis=1), axis=1, count=width).view(np.bool_)
+        ids = np.where(rows.any(axis=1))[0]
+        boxes[ids, 0] = np.argmax(rows[ids], axis=1)
+        boxes[ids, 1] = np.argmax(columns[ids], axis=1)
+        boxes[ids, 2] = height - np.argmax(rows[ids, ::-1], axis=1)
+        boxes[ids, 3] = width - np.argmax(columns[ids, ::-1], axis=1)
+        return boxes
+
+    def intersection(self, other):
+        """Returns the pixel counts of the intersections of every instance
+        with every instance of other as [instances, other instances]."""
+        assert self.shape[:2] == other.shape[:2]
+        intersections = np.zeros([self.shape[2], other.shape[2]], dtype=np.int64)
+        if other.shape[2] == 0:
+            return intersections
+        boxes = self.bboxes()
+        for i in range(self.shape[2]):
+            # Only the rows the instance covers can intersect
+            y1, y2 = boxes[i, 0], boxes[i, 2]
+            if y1 == y2:
+                continue
+            common = np.bitwise_and(self.bits[i, y1:y2], other.bits[:, y1:y2])
+            intersections[i] = _POPCOUNT[common].sum(axis=(1, 2), dtype=np.int64)
+        return intersections
+
+    def union(self, other, intersections=None):
+        """Returns the pixel counts of the unions of every instance with
+        every instance of other as [instances, other instances]."""
+        if intersections is None:
+            intersections = self.intersection(other)
+        return self.area()[:, None] + other.area()[None, :] - intersections
+
+    def iou(self, other):
+        """Returns the IoU of every instance with every instance of other,
+        the same as compute_overlaps_masks() of the dense masks."""
+        intersections = self.intersection(other)
+        union = self.union(other, intersections)
+        return intersections.astype(np.float32) / union.astype(np.float32)
+
+
+def _rle_covered(starts, ends, cumulative, positions):
+    """Number of set pixels of a run-length encoded mask before each of the
+    flat positions. cumulative: run lengths summed, starting with 0."""
+    i = np.searchsorted(starts, positions, side="left")
+    # Runs starting before the position are complete, except for the part
+    # of the last one at or after the position
+    partial = np.maximum(ends[np.maximum(i - 1, 0)] - positions, 0)
+    return cumulative[i] - np.where(i > 0, partial, 0)
+
+
+def _rle_intersection(starts1, ends1, starts2, ends2):
+    """Number of pixels set in both run-length encoded masks."""
+    if starts1.shape[0] == 0 or starts2.shape[0] == 0:
+        return 0
+    # Only runs of mask 1 within the extent of mask 2 can intersect
+    lo = np.searchsorted(ends1, starts2[0], side="right")
+    hi = np.searchsorted(starts1, ends2[-1], side="left")
+    if lo >= hi:
+        return 0
+    starts1, ends1 = starts1[lo:hi], ends1[lo:hi]
+    cumulative = np.concatenate([[0], np.cumsum(ends2 - starts2)])
+    return int(np.sum(_rle_covered(starts2, ends2, cumulative, ends1) -
+                      _rle_covered(starts2, ends2, cumulative, starts1)))
+
+
+class RLEMasks(object):
+    """Instance masks run-length encoded like COCO RLE: each mask is
+    flattened in column-major order and stored as the [start, end) flat
+    positions of its runs of set pixels. Memory and the cost of area,
+    bounding boxes, intersection and union scale with the mask outlines
+    rather than the image area. Like PackedMasks it stands in for a dense
+    [height, width, instances] bool array.
+
+    starts, ends: lists with an int64 array of run positions per instance.
+    shape: (height, width, instances) of the dense masks.
+    """
+
+    dtype = np.dtype(np.bool_)
+    ndim = 3
+
+    def __init__(self, starts, ends, shape):
+        assert len(starts) == len(ends) == shape[2]
+        self.starts = list(starts)
+        self.ends = list(ends)
+        self.shape = tuple(int(d) for d in shape)
+
+    @classmethod
+    def from_dense(cls, mask):
+        """Encodes a [height, width, instances] mask. Non-zero pixels are set."""
+        mask = mask.astype(bool, copy=False)
+        height, width, count = mask.shape
+        starts, ends = [], []
+        for i, (y1, x1, y2, x2) in enumerate(extract_bboxes(mask)):
+            if y1 == y2:
+                starts.append(np.zeros([0], dtype=np.int64))
+                ends.append(np.zeros([0], dtype=np.int64))
+                continue
+            # Only the bounding box is encoded, column by column with a
+            # zero before and after each column
+            h = y2 - y1
+            padded = np.zeros([x2 - x1, h + 2], dtype=bool)
+            padded[:, 1:-1] = mask[y1:y2, x1:x2, i].T
+            column, row = np.divmod(np.flatnonzero(padded[:, 1:] != padded[:, :-1]), h + 1)
+            flat = (x1 + column) * height + y1 + row
+            run_starts, run_ends = flat[0::2], flat[1::2]
+            # Join runs that continue into the next column
+            joined = run_starts[1:] == run_ends[:-1]
+            starts.append(run_starts[np.append(True, ~joined)])
+            ends.append(run_ends[np.append(~joined, True)])
+        return cls(starts, ends, mask.shape)
+
+    @classmethod
+    def from_counts(cls, counts, shape):
+        """Builds the masks from COCO RLE counts, one list per instance,
+        alternating runs of unset and set pixels. shape: (height, width)."""
+        starts, ends = [], []
+        for c in counts:
+            bounds = np.cumsum(np.asarray(c, dtype=np.int64))
+            # Skip empty runs, which COCO allows
+            bounds = bounds[:bounds.shape[0] // 2 * 2].reshape([-1, 2])
+            bounds = bounds[bounds[:, 1] > bounds[:, 0]]
+            starts.append(bounds[:, 0].copy())
+            ends.append(bounds[:, 1].copy())
+        return cls(starts, ends, tuple(shape[:2]) + (len(starts),))
+
+    def counts(self):
+        """Returns the COCO RLE counts of each instance."""
+        size = self.shape[0] * self.shape[1]
+        counts = []
+        for starts, ends in zip(self.starts, self.ends):
+            bounds = np.stack([starts, ends], axis=1).reshape([-1])
+            c = np.diff(np.concatenate([[0], bounds, [size]]))
+            counts.append(c[:-1] if c.shape[0] > 1 and c[-1] == 0 else c)
+        return counts
+
+    def to_dense(self):
+        """Returns the [height, width, instances] bool mask."""
+        height, width, count = self.shape
+        mask = np.zeros([height, width, count], dtype=bool)
+        for i in range(count):
+            mask[:, :, i] = self[i]
+        return mask
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.to_dense()
+        return mask if dtype is None else mask.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes + e.nbytes for s, e in zip(self.starts, self.ends))
+
+    def __getitem__(self, key):
+        # An integer index returns the dense 2D mask
+        key = _instance_key(key)
+        if isinstance(key, (int, np.integer)):
+            height, width = self.shape[:2]
+            # Runs are disjoint and separated, so +1/-1 at their bounds
+            # never collide
+            delta = np.zeros([height * width + 1], dtype=np.int8)
+            delta[self.starts[key]] = 1
+            delta[self.ends[key]] = -1
+            return np.cumsum(delta[:-1], dtype=np.int8).astype(bool).reshape([width, height]).T
+        ids = np.arange(self.shape[2])[key]
+        return RLEMasks([self.starts[i] for i in ids], [self.ends[i] for i in ids],
+                        self.shape[:2] + (ids.shape[0],))
+
+    def area(self):
+        """Returns the number of pixels of each instance [instances]."""
+        return np.array([np.sum(e - s) for s, e in zip(self.starts, self.ends)], dtype=np.int64)
+
+    def bboxes(self):
+        """Returns the bounding boxes [instances, (y1, x1, y2, x2)] like
+        extract_bboxes(). Empty masks get all zero boxes."""
+        height = self.shape[0]
+        boxes = np.zeros([self.shape[2], 4], dtype=np.int32)
+        for i, (starts, ends) in enumerate(zip(self.starts, self.ends)):
+            if starts.shape[0] == 0:
+                continue
+            last = ends - 1
+            # A run that continues into the next column covers the last row
+            # of one column and the first row of the next
+            if np.any(starts // height != last // height):
+                y1, y2 = 0, height
+            else:
+                y1, y2 = np.min(starts % height), np.max(last % height) + 1
+            boxes[i] = [y1, starts[0] // height, y2, last[-1] // height + 1]
+        return boxes
+
+    def intersection(self, other):
+        """Returns the pixel counts of the intersections of every instance
+        with every instance of other as [instances, other instances]."""
+        assert self.shape[:2] == other.shape[:2]
+        intersections = np.zeros([self.shape[2], other.shape[2]], dtype=np.int64)
+        # Only pairs with overlapping bounding boxes can intersect
+        boxes1, boxes2 = self.bboxes(), other.bboxes()
+        overlapping = (np.minimum(boxes1[:, None, 2], boxes2[:, 2]) > np.maximum(boxes1[:, None, 0], boxes2[:, 0])) & \
+                      (np.minimum(boxes1[:, None, 3], boxes2[:, 3]) > np.maximum(boxes1[:, None, 1], boxes2[:, 1]))
+        for i, j in zip(*np.where(overlapping)):
+            intersections[i, j] = _rle_intersection(self.starts[i], self.ends[i],
+                                                    other.starts[j], other.ends[j])
+        return intersections
+
+    def union(self, other, intersections=None):
+        """Returns the pixel counts of the unions of every instance with
+        every instance of other as [instances, other instances]."""
+        if intersections is None:
+            intersections = self.intersection(other)
+        return self.area()[:, None] + other.area()[None, :] - intersections
+
+    def iou(self, other):
+        """Returns the IoU of every instance with every instance of other,
+        the same as compute_overlaps_masks() of the dense masks."""
+        intersections = self.intersection(other)
+        union = self.union(other, intersections)
+        return intersections.astype(np.float32) / union.astype(np.float32)
+
+
 ############################################################
 #  Dataset
 ############################################################
 
+class ImageCache(object):
+    """Cache of decoded images shared by Dataset.load_image().
+
+    Decoded images are kept in RAM in least-recently-used order until
+    max_bytes is reached. If cache_dir is given, each decoded image is also
+    saved there as a raw uint8 .npy file and memory-mapped on later runs, so
+    JPEG decoding only happens once per image.
+
+    Cached images are read-only. Copy them before modifying in place.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # load_image() may be called from several threads (e.g. tf.data)
+        self.lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # Subclasses store other kinds of entries by overriding the extension
+    # and _entry_bytes(), _encode(), _decode(), _load() and _save().
+    _extension = ".npy"
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return entry.nbytes
+
+    def _encode(self, image):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        image.flags.writeable = False
+        return image
+
+    def _decode(self, entry):
+        return entry
+
+    def _load(self, key):
+        try:
+            # Memory-mapped, the OS page cache keeps it in RAM
+            return np.load(self._path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, path, entry):
+        np.save(path, entry)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + self._extension)
+
+    def _remember(self, key, entry):
+        size = self._entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self._entry_bytes(self.entries.pop(key))
+        self.entries[key] = entry
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= self._entry_bytes(evicted)
+
+    def get(self, key):
+        """Returns the cached image for key or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None and self.cache_dir is not None:
+            entry = self._load(key)
+        if entry is None:
+            return None
+        return self._decode(entry)
+
+    def put(self, key, image):
+        """Caches image under key and returns the stored entry."""
+        entry = self._encode(image)
+        with self.lock:
+            self._remember(key, entry)
+        if self.cache_dir is not None:
+            path = self._path(key)
+            # Write to a temporary file first so readers never see a partial file
+            temp_path = "{}.{}.{}.tmp{}".format(path[:-len(self._extension)], os.getpid(),
+                                                threading.get_ident(), self._extension)
+            self._save(temp_path, entry)
+            os.replace(temp_path, path)
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # Worker processes start with an empty RAM cache and share the disk store
+        state = self.__dict__.copy()
+        del state['lock']
+        state['entries'] = OrderedDict()
+        state['total_bytes'] = 0
+        return state
+
+    def __setstate__(self, state):
+        state['lock'] = threading.Lock()
+        self.__dict__.update(state)
+
+
 class Dataset(object):
     """The base class for dataset classes.
     To use it, create a new class that adds functions specific to the dataset
@@ -258,6 +827,11 @@ class Dataset(object):
         # Background is always the first class
         self.class_info = [{"source": "", "id": 0, "name": "BG"}]
         self.source_class_ids = {}
+        self.image_cache = None
+
+    def set_image_cache(self, image_cache):
+        """Use an ImageCache for load_image(). None disables caching."""
+        self.image_cache = image_cache
 
     def add_class(self, source, class_id, class_name):
         assert "." not in source, "Source name cannot contain a dot"
@@ -354,6 +928,22 @@ class Dataset(object):
 
     def load_image(self, image_id):
         """Load the specified image and return a [H,W,3] Numpy array.
+
+        If an image cache is set, the returned array is read-only.
+        """
+        if self.image_cache is None:
+            return self.decode_image(image_id)
+        # The file size and modification time invalidate stale entries
+        path = self.image_info[image_id]['path']
+        stat = os.stat(path)
+        key = "{}@{}-{}".format(path, stat.st_size, stat.st_mtime_ns)
+        image = self.image_cache.get(key)
+        if image is None:
+            image = self.image_cache.put(key, self.decode_image(image_id))
+        return image
+
+    def decode_image(self, image_id):
+        """Read and decode the specified image into a [H,W,3] Numpy array.
         """
         # Load image
         image = skimage.io.imread(self.image_info[image_id]['path'])
@@ -374,7 +964,7 @@ class Dataset(object):
 
         Returns:
             masks: A bool array of shape [height, width, instance count] with
-                a binary mask per instance.
+                a binary mask per instance, or the same as PackedMasks.
             class_ids: a 1D array of class IDs of the instance masks.
         """
         # Override this function to load a mask from your dataset.
@@ -500,7 +1090,11 @@ def resize_mask(mask, scale, padding, crop=None):
     scale: mask scaling factor
     padding: Padding to add to the mask in the form
             [(top, bottom), (left, right), (0, 0)]
+
+    PackedMasks are unpacked; the resized mask is always dense.
     """
+    if isinstance(mask, PackedMasks):
+        mask = mask.to_dense()
     # Suppress warning from scipy 0.13.0, the output shape of zoom() is
     # calculated with round() instead of int()
     with warnings.catch_warnings():
@@ -639,6 +1233,67 @@ def generate_pyramid_anchors(scales, ratios, feature_shapes, feature_strides,
     return np.concatenate(anchors, axis=0)
 
 
+class AnchorIndex(object):
+    """Spatial index of anchors for finding the anchors that intersect a box.
+
+    Anchors of the same size (one pyramid level and ratio) lie on a regular
+    grid with the stride of their level. Each such group is stored as a
+    [rows, columns] table of anchor indices with the y/x extents of its rows
+    and columns, so the anchors that can intersect a box are a rectangle of
+    the table found with binary search. Anchors outside every rectangle have
+    an IoU of exactly 0 with the box.
+
+    anchors: [N, (y1, x1, y2, x2)] as returned by generate_pyramid_anchors().
+    """
+
+    def __init__(self, anchors):
+        self.num_anchors = anchors.shape[0]
+        self.grids = []
+        # Anchors that don't form a complete grid are always candidates
+        self.dense = []
+        sizes = np.round(np.stack([anchors[:, 2] - anchors[:, 0],
+                                   anchors[:, 3] - anchors[:, 1]], axis=1), 3)
+        _, groups = np.unique(sizes, axis=0, return_inverse=True)
+        groups = groups.reshape([-1])
+        for group in range(groups.max() + 1 if groups.size else 0):
+            ids = np.where(groups == group)[0]
+            y1s = np.unique(anchors[ids, 0])
+            x1s = np.unique(anchors[ids, 1])
+            if y1s.shape[0] * x1s.shape[0] != ids.shape[0]:
+                self.dense.append(ids)
+                continue
+            table = np.empty([y1s.shape[0], x1s.shape[0]], dtype=np.int64)
+            table[np.searchsorted(y1s, anchors[ids, 0]),
+                  np.searchsorted(x1s, anchors[ids, 1])] = ids
+            # Largest y2/x2 up to each row/column, so both bounds are sorted
+            y2s = np.maximum.accumulate(anchors[table, 2].max(axis=1))
+            x2s = np.maximum.accumulate(anchors[table, 3].max(axis=0))
+            self.grids.append((table, y1s, x1s, y2s, x2s))
+
+    def candidate_mask(self, boxes):
+        """Returns a [N] bool array marking anchors that may intersect any of
+        the boxes [count, (y1, x1, y2, x2)]."""
+        mask = np.zeros([self.num_anchors], dtype=bool)
+        if boxes.shape[0] == 0:
+            return mask
+        for ids in self.dense:
+            mask[ids] = True
+        for table, y1s, x1s, y2s, x2s in self.grids:
+            # Rows/columns with anchor y2 > box y1 and anchor y1 < box y2 (same for x)
+            row_start = np.searchsorted(y2s, boxes[:, 0], side="right")
+            row_end = np.searchsorted(y1s, boxes[:, 2], side="left")
+            col_start = np.searchsorted(x2s, boxes[:, 1], side="right")
+            col_end = np.searchsorted(x1s, boxes[:, 3], side="left")
+            for r0, r1, c0, c1 in zip(row_start, row_end, col_start, col_end):
+                if r0 < r1 and c0 < c1:
+                    mask[table[r0:r1, c0:c1]] = True
+        return mask
+
+    def candidates(self, boxes):
+        """Returns the sorted indices of anchors that may intersect any of the boxes."""
+        return np.flatnonzero(self.candidate_mask(boxes))
+
+
 ############################################################
 #  Miscellaneous
 ############################################################
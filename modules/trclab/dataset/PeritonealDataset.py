@@ -0,0 +1,117 @@
+import os
+import skimage.draw
+import numpy as np
+
+from ...mrcnn import utils
+from ..utils.ImageSize import get_image_size
+from ..vhp.ViaBinaryLabels import load_via_annotations, load_via_labels
+
+
+class PeritonealDataset(utils.Dataset):
+    """ 各專案共用的 VIA 標記資料集
+
+    source      資料來源名稱 (RECOGNIZABLE_NAME)
+    classes     類別名稱，不含 BG，類別編號依序從 1 開始
+    mask_cache  已光柵化遮罩的快取 (需提供 get(key) 與 put(key, mask))，None 表示不快取
+    """
+
+    def __init__(self, source: str, classes: list, mask_cache=None, class_map=None):
+        super().__init__(class_map)
+        self.source = source
+        self.classes = list(classes)
+        self.mask_cache = mask_cache
+        # 區域名稱對應到類別編號，不在類別內的名稱為 0
+        self.class_index = {name: i for i, name in enumerate(self.classes, start=1)}
+
+    def load_via(self, dataset_dir, subset):
+        for i, name in enumerate(self.classes, start=1):
+            self.add_class(self.source, i, name)
+
+        assert subset in ["train", "val"]
+        dataset_dir = os.path.join(dataset_dir, subset)
+
+        annotations_file = os.path.join(dataset_dir, "via_region_data.json")
+        annotations_stat = os.stat(annotations_file)
+        label_version = "{}-{}".format(annotations_stat.st_size, annotations_stat.st_mtime_ns)
+
+        labels = load_via_labels(annotations_file)
+        if labels is not None:
+            self.__add_labels(labels, dataset_dir, label_version)
+        else:
+            self.__add_annotations(load_via_annotations(annotations_file), dataset_dir, label_version)
+
+    def __add_labels(self, labels, dataset_dir, label_version):
+        # 名稱表只有幾十項，先轉成類別編號後一次對所有區域查表
+        name_ids = np.array([self.class_index.get(name, 0) for name in labels.names], dtype=np.int32)
+        region_class_ids = name_ids[labels.region_names]
+
+        for image_index in range(len(labels)):
+            regions = labels.region_range(image_index)
+            if not len(regions):
+                continue
+
+            annotation = labels.annotation(image_index)
+            self.__add_image(dataset_dir, annotation, label_version,
+                             region_class_ids[regions.start:regions.stop])
+
+    def __add_annotations(self, annotations, dataset_dir, label_version):
+        for a in annotations:
+            if not a['regions']:
+                continue
+
+            if type(a['regions']) is dict:
+                a['regions'] = list(a['regions'].values())
+
+            class_ids = np.array([self.class_index.get(r['region_attributes'].get('name'), 0)
+                                  for r in a['regions']], dtype=np.int32)
+            self.__add_image(dataset_dir, a, label_version, class_ids)
+
+    def __add_image(self, dataset_dir, annotation, label_version, class_ids):
+        image_path = os.path.join(dataset_dir, annotation['filename'])
+        height, width = get_image_size(image_path)
+
+        self.add_image(
+            self.source,
+            image_id=annotation["filename"],
+            path=image_path,
+            width=width, height=height,
+            polygons=[r['shape_attributes'] for r in annotation['regions']],
+            names=[r['region_attributes'] for r in annotation['regions']],
+            class_ids=class_ids,
+            label_version=label_version
+        )
+
+    def load_peritoneal(self, dataset_dir, subset):
+        self.load_via(dataset_dir, subset)
+
+    def load_mask(self, image_id):
+        info = self.image_info[image_id]
+        if info["source"] != self.source:
+            return super().load_mask(image_id)
+
+        # 類別編號在註冊時已依目前的類別清單算好，快取只存遮罩
+        class_ids = info["class_ids"].copy()
+        cache_key = "{}@{}".format(info["path"], info["label_version"])
+        if self.mask_cache is not None:
+            cached = self.mask_cache.get(cache_key)
+            if cached is not None:
+                return cached, class_ids
+
+        shape = (info["height"], info["width"])
+        mask = np.zeros(shape + (len(info["polygons"]),), dtype=np.bool_)
+        for i, p in enumerate(info["polygons"]):
+            # Get indexes of pixels inside the polygon and set them to 1
+            rr, cc = skimage.draw.polygon(p['all_points_y'], p['all_points_x'], shape)
+            mask[rr, cc, i] = True
+
+        if self.mask_cache is not None:
+            self.mask_cache.put(cache_key, mask)
+
+        return mask, class_ids
+
+    def image_reference(self, image_id):
+        info = self.image_info[image_id]
+        if info["source"] == self.source:
+            return info["path"]
+        else:
+            return super().image_reference(image_id)
@@ -0,0 +1 @@
+from .PeritonealDataset import PeritonealDataset
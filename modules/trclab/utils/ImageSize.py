@@ -0,0 +1,19 @@
+import os
+from functools import lru_cache
+
+from PIL import Image
+
+
+@lru_cache(maxsize=None)
+def _read_image_size(image_path: str, file_size: int, mtime_ns: int) -> tuple:
+    # Image.open 只解析檔頭，不會解碼像素資料
+    with Image.open(image_path) as image:
+        width, height = image.size
+
+    return height, width
+
+
+def get_image_size(image_path: str) -> tuple:
+    """ 回傳圖片的 (height, width)，以檔案大小與修改時間快取結果，同一個檔案只讀一次檔頭 """
+    stat = os.stat(image_path)
+    return _read_image_size(image_path, stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from ...mrcnn.utils import ImageCache
+
+
+class MaskCache(ImageCache):
+    """ 已光柵化的實例遮罩快取，以 np.packbits 位元壓縮 (每像素每實例 1 bit) 存在記憶體，
+    超過容量時淘汰最久未使用的項目；指定 cache_dir 時同時存到磁碟供下次執行使用
+
+    與 ImageCache 共用 LRU、磁碟與序列化的行為，子程序從空的記憶體快取開始；
+    get(key) 回傳遮罩，put(key, mask) 只快取遮罩，類別編號隨類別清單改變，由資料集在註冊時計算 """
+
+    _extension = ".npz"
+
+    @staticmethod
+    def _entry_bytes(entry) -> int:
+        return entry[0].nbytes
+
+    def _encode(self, mask: np.ndarray):
+        return np.packbits(mask.astype(np.bool_, copy=False)), mask.shape
+
+    def _decode(self, entry) -> np.ndarray:
+        packed, shape = entry
+        return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape).view(np.bool_)
+
+    def _load(self, key: str):
+        try:
+            with np.load(self._path(key)) as data:
+                entry = data['packed'], tuple(data['shape'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # 壓縮後的遮罩很小，從磁碟讀取後放入記憶體
+        with self.lock:
+            self._remember(key, entry)
+
+        return entry
+
+    def _save(self, path: str, entry):
+        np.savez(path, packed=entry[0], shape=np.array(entry[1]))
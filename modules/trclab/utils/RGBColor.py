@@ -1,4 +1,5 @@
 import json
+import numpy as np
 
 from ..serialize.ISerializable import ISerializable
 
@@ -32,3 +33,13 @@ class RGBColor(ISerializable):
 
     def deserialize(self) -> dict:
         return json.loads(self.serialize_data)
+
+
+def pack_rgb(rgb) -> np.ndarray:
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def unpack_rgb(packed) -> np.ndarray:
+    packed = np.asarray(packed, dtype=np.uint32)
+    return np.stack([(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=-1).astype(np.uint8)
@@ -1,12 +1,15 @@
 import json
 import numpy
 import os
-from glob import glob
+import zlib
+from fnmatch import fnmatch
 from multiprocessing import Pool
 
 from ..utils.ProgressBar import ProgressBar
 from ..vhp.OrganImage import OrganImage
 from ..vhp.OrganImageReader import OrganImageReader
+from ..vhp.ViaBinaryLabels import ViaBinaryWriter, sidecar_path
+from ..vhp.ViaJsonWriter import ViaJsonWriter
 
 
 class MyEncoder(json.JSONEncoder):
@@ -21,38 +24,61 @@ class MyEncoder(json.JSONEncoder):
             return super(MyEncoder, self).default(obj)
 
 
-def data_process(image, label, target_dir, extension):
-    image_name = os.path.basename(image.get_file())
-    progress_bar = ProgressBar(2, "Start Process Image {}".format(image_name))
+def via_key(image, target_dir, extension):
+    target_basename = image.basename[:-len(image.extension)] + extension
+    target_file_size = os.path.getsize(os.path.join(target_dir, target_basename))
+    return target_basename + str(target_file_size), target_basename, target_file_size
 
-    progress_bar.update("Processing...")
-    oir = OrganImageReader(image, label)
-    data = json.loads("{}")
+
+def available_cpu_count() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+# 子程序共用的唯讀標籤與快取，由 Pool initializer 設定一次，不隨每個任務傳送
+_worker_label = None
+_worker_cache = None
+
+
+def contour_settings(simplify: float = None) -> str:
+    # 輪廓產生方式，變更時快取需視為不同的結果
+    if simplify is None:
+        return "RETR_EXTERNAL,CHAIN_APPROX_NONE"
+
+    return "RETR_EXTERNAL,CHAIN_APPROX_SIMPLE,DP={}".format(float(simplify))
+
+
+def init_worker(label, cache=None):
+    global _worker_label, _worker_cache
+    _worker_label = label
+    _worker_cache = cache
+
+
+def data_process_task(task):
+    image_file, target_dir, extension, single_pass, simplify = task
+    return data_process(OrganImage(image_file), _worker_label, target_dir, extension, single_pass, _worker_cache,
+                        simplify)
+
+
+def generate_regions(image, label, single_pass: bool, progress_bar: ProgressBar, simplify: float = None) -> dict:
+    oir = OrganImageReader(image, label, simplify)
+    regions = {}
 
     organ_list = oir.find_organ()
     progress_bar.update("Found Organ Count {}".format(len(organ_list)))
     progress_bar.add_max_val(len(organ_list))
 
-    target_basename = image.basename[:-len(image.extension)] + extension
-    target_file_size = os.path.getsize(os.path.join(target_dir, target_basename))
-    key = target_basename + str(target_file_size)
-    progress_bar.update("Generate Data Key {}".format(key))
-
-    data[key] = {}
-    data[key]['fileref'] = ''
-    data[key]['size'] = target_file_size
-    data[key]['filename'] = target_basename
-    data[key]['base64_img_data'] = ''
-    data[key]['file_attributes'] = {}
-    data[key]['regions'] = {}
-    progress_bar.update("Init Basic Data Format")
+    if single_pass:
+        organ_contours = oir.get_all_contours().items()
+    else:
+        organ_indices = [oir.get_index(organ) for organ in organ_list]
+        organ_contours = ((index, oir.get_contours(oir.get_mask(index))) for index in organ_indices)
 
     region_idx = 0
-    for idx, organ in enumerate(organ_list):
+    for idx, (index, contours) in enumerate(organ_contours):
         progress_bar.update("Processing Organ {}".format(idx))
-        index = oir.get_index(organ)
-        filter_image = oir.filter_from_index(index)
-        contours = oir.get_contours(filter_image)
         for n in range(0, len(contours)):
             list_x = []
             list_y = []
@@ -61,61 +87,124 @@ def data_process(image, label, target_dir, extension):
                     list_x.append(x)
                     list_y.append(y)
 
-            data[key]['regions'][region_idx] = {}
-            data[key]['regions'][region_idx]['shape_attributes'] = {}
-            data[key]['regions'][region_idx]['shape_attributes']['name'] = 'polygon'
-            data[key]['regions'][region_idx]['shape_attributes']['all_points_x'] = list_x
-            data[key]['regions'][region_idx]['shape_attributes']['all_points_y'] = list_y
-            data[key]['regions'][region_idx]['region_attributes'] = {}
-            data[key]['regions'][region_idx]['region_attributes']['name'] = oir.get_name(index)
+            regions[region_idx] = {}
+            regions[region_idx]['shape_attributes'] = {}
+            regions[region_idx]['shape_attributes']['name'] = 'polygon'
+            regions[region_idx]['shape_attributes']['all_points_x'] = list_x
+            regions[region_idx]['shape_attributes']['all_points_y'] = list_y
+            regions[region_idx]['region_attributes'] = {}
+            regions[region_idx]['region_attributes']['name'] = oir.get_name(index)
             region_idx += 1
 
+    if simplify:
+        progress_bar.update("Max Simplify Deviation {:.2f} px".format(oir.max_deviation), just_message=True)
+
+    image.release()
+    return regions
+
+
+def data_process(image, label, target_dir, extension, single_pass: bool = True, cache=None,
+                 simplify: float = None):
+    image_name = os.path.basename(image.get_file())
+    progress_bar = ProgressBar(2, "Start Process Image {}".format(image_name))
+
+    progress_bar.update("Processing...")
+    data = json.loads("{}")
+
+    key, target_basename, target_file_size = via_key(image, target_dir, extension)
+    progress_bar.update("Generate Data Key {}".format(key))
+
+    data[key] = {}
+    data[key]['fileref'] = ''
+    data[key]['size'] = target_file_size
+    data[key]['filename'] = target_basename
+    data[key]['base64_img_data'] = ''
+    data[key]['file_attributes'] = {}
+    progress_bar.update("Init Basic Data Format")
+
+    regions = None
+    if cache is not None:
+        cache_key = cache.make_key(image.get_file(), label, contour_settings(simplify))
+        regions = cache.get(cache_key)
+        if regions is not None:
+            progress_bar.update("Load Regions From Cache")
+
+    if regions is None:
+        regions = generate_regions(image, label, single_pass, progress_bar, simplify)
+        if cache is not None:
+            cache.put(cache_key, regions)
+
+    data[key]['regions'] = regions
     progress_bar.finish("Process Successful!")
     return data
 
 
 class OrganDataset:
-    def __init__(self, image_dir: str, extension: str = "*.jpg"):
-        self.images = list()
+    def __init__(self, image_dir: str, extension: str = "*.jpg", shard_index: int = 0, num_shards: int = 1):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be in [0, %d), got %d" % (num_shards, shard_index))
+
+        self.image_dir = image_dir
         self.extension = extension
+        self.shard_index = shard_index
+        self.num_shards = num_shards
         self.images_label = None
 
-        load_images = glob(os.path.join(image_dir, extension), recursive=True)
-        progress_bar = ProgressBar(len(load_images), title="Loaded Organ Dataset")
-        for img in load_images:
-            progress_bar.update("process image %s" % os.path.basename(img))
-            self.images.append(OrganImage(img))
+    def paths(self):
+        # 以 os.scandir 逐一產生檔案路徑，不預先建立整個清單
+        with os.scandir(self.image_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and fnmatch(entry.name, self.extension) and self.__in_shard(entry.name):
+                    yield entry.path
+
+    def __in_shard(self, name: str) -> bool:
+        # 依檔名的 CRC32 分片，不同機器掃描順序不同也會得到相同的分配
+        if self.num_shards == 1:
+            return True
 
-        progress_bar.finish('Dataset loaded successful!')
+        return zlib.crc32(name.encode('utf-8')) % self.num_shards == self.shard_index
+
+    def __iter__(self):
+        for path in self.paths():
+            yield OrganImage(path)
+
+    def __len__(self):
+        return sum(1 for _ in self.paths())
 
     def set_label(self, vhp_label):
         self.images_label = vhp_label
 
-    def export_label_area(self, target_dir, patten: str, output_file):
+    def export_label_area(self, target_dir, patten: str, output_file, single_pass: bool = True,
+                          resume: bool = False, workers: int = None, chunksize: int = None, cache=None,
+                          simplify: float = None, sidecar: bool = False):
         if self.images_label is None:
             raise FileNotFoundError
 
-        with open(output_file, 'w+', encoding='utf-8') as export_file:
-            export_file.write("{\n}")
-
         target_name_split = patten.split('.')
         target_extension = target_name_split[len(target_name_split) - 1]
 
-        # progress_bar = ProgressBar(len(self.images), "Export label area")
-        # counter = 0
-
-        with Pool(5) as pool:
-            process_data = []
-            for image in self.images:
-                process = (image, self.images_label, target_dir, target_extension)
-                process_data.append(process)
-
-            rst = pool.starmap(data_process, process_data)
-
-        merged_dict = dict()
-        if len(rst) != 0:
-            for data in rst:
-                merged_dict.update(data)
-
-        with open(output_file, 'w', encoding='utf-8') as out_file:
-            json.dump(merged_dict, out_file, default=int, cls=MyEncoder)
+        if workers is None:
+            workers = available_cpu_count()
+
+        # 每次分派數張影像以減少程序間往返，程序越多每批越小，結尾時各程序的工作量較平均；
+        # 只依程序數量決定，不需為估算影像數量而掃描目錄
+        if chunksize is None:
+            chunksize = max(4, min(8, 64 // workers))
+
+        sidecar_writer = ViaBinaryWriter(sidecar_path(output_file)) if sidecar else None
+        with ViaJsonWriter(output_file, resume=resume, cls=MyEncoder, sidecar=sidecar_writer) as writer:
+            finished_keys = set(writer.written_keys)
+            process_data = (
+                (image.get_file(), target_dir, target_extension, single_pass, simplify)
+                for image in self
+                if not finished_keys or via_key(image, target_dir, target_extension)[0] not in finished_keys
+            )
+
+            # 每處理完一張影像就立即寫入檔案，不在主程序中累積全部結果
+            with Pool(workers, initializer=init_worker, initargs=(self.images_label, cache)) as pool:
+                for data in pool.imap_unordered(data_process_task, process_data, chunksize=chunksize):
+                    writer.update(data)
+
+            # 子程序只在寫入量累積夠多時淘汰，結束時再確保快取不超過容量
+            if cache is not None:
+                cache.evict()
@@ -2,6 +2,8 @@ import numpy as np
 import os
 from PIL import Image
 
+from ..utils.RGBColor import pack_rgb, unpack_rgb
+
 
 class OrganImage:
     def __init__(self, image_file: str):
@@ -9,21 +11,33 @@ class OrganImage:
         self.basename = os.path.basename(image_file)
         ts = self.basename.split('.')
         self.extension = ts[len(ts) - 1]
-        self._image_rgb_list = None
+        self._packed_plane = None
 
-    def get_rgb_list(self) -> list:
-        if self._image_rgb_list is None:
+    def get_packed(self) -> np.ndarray:
+        # 只保留一張 uint32 (0x00RRGGBB) 顏色平面，第一次使用時才解碼
+        if self._packed_plane is None:
             with Image.open(self.filepath) as image:
-                image_rgb = np.array(image)
-                color = []
-                for rgb in image_rgb:
-                    for n in rgb:
-                        n = list(n)
-                        color.append((n[0], n[1], n[2]))
+                self._packed_plane = pack_rgb(np.asarray(image.convert('RGB')))
+
+        return self._packed_plane
+
+    def get_array(self) -> np.ndarray:
+        return unpack_rgb(self.get_packed())
 
-                self._image_rgb_list = color
+    def unique_colors(self) -> np.ndarray:
+        return np.unique(self.get_packed())
 
-        return self._image_rgb_list
+    def get_shape(self) -> tuple:
+        return self.get_packed().shape
+
+    def release(self):
+        self._packed_plane = None
 
     def get_file(self):
         return self.filepath
+
+    def __getstate__(self):
+        # 傳送至子程序時不帶影像資料，由子程序自行解碼
+        state = self.__dict__.copy()
+        state['_packed_plane'] = None
+        return state
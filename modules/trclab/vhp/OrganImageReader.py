@@ -1,59 +1,108 @@
 import cv2
 import numpy as np
-from PIL import Image
+from scipy import ndimage
 
 from ..vhp.OrganImage import OrganImage
 from ..vhp.OrganLabel import OrganLabel
 
 
+def boundary_points(contour: np.ndarray) -> np.ndarray:
+    """ 將 CHAIN_APPROX_SIMPLE 的輪廓展開為所有邊界點 (轉折點之間為 8 方向、每步 1 像素的直線) """
+    points = contour.reshape(-1, 2).astype(np.int64)
+    directions = np.roll(points, -1, axis=0) - points
+    steps = np.maximum(np.abs(directions).max(axis=1), 1)
+    starts = np.repeat(np.arange(len(points)), steps)
+    offsets = np.arange(len(starts)) - np.repeat(np.cumsum(steps) - steps, steps)
+    return points[starts] + directions[starts] // steps[starts, np.newaxis] * offsets[:, np.newaxis]
+
+
+def polygon_deviation(points: np.ndarray, polygon: np.ndarray, block_size: int = 4096) -> float:
+    """ 所有點到多邊形邊界的最大距離 (像素) """
+    starts = polygon.reshape(-1, 2).astype(np.float64)
+    edges = np.roll(starts, -1, axis=0) - starts
+    lengths = np.maximum((edges * edges).sum(axis=1), 1e-12)
+    deviation = 0.0
+    for i in range(0, len(points), block_size):
+        # 分塊計算每個點到每條邊的距離，避免一次建立 點數 x 邊數 的大矩陣
+        relative = points[i:i + block_size, np.newaxis, :].astype(np.float64) - starts
+        t = np.clip((relative * edges).sum(axis=2) / lengths, 0, 1)
+        offsets = relative - t[:, :, np.newaxis] * edges
+        deviation = max(deviation, float(np.sqrt((offsets * offsets).sum(axis=2).min(axis=1).max())))
+
+    return deviation
+
+
 class OrganImageReader:
-    def __init__(self, image: OrganImage, label: OrganLabel):
+    def __init__(self, image: OrganImage, label: OrganLabel, simplify: float = None):
         self.organ_image = image
-        self.image_rgb_list = []
-        for rgb in image.get_rgb_list():
-            self.image_rgb_list.append([*rgb, ])
-
-        self.image_rgb_set = set(image.get_rgb_list())
-        self.label_rgb_list = []
         self.label_list = label
-        for rgb in label.get_rgb_list():
-            self.label_rgb_list.append([*rgb, ])
+        self.palette = label.get_palette()
 
-        self.label_rgb_set = set(label.get_rgb_list())
-        self.intersection_set = self.image_rgb_set.intersection(self.label_rgb_set)
+        # 每個像素對應的標籤索引 (從 1 開始，0 表示不在標籤內)
+        self.label_map = self.palette.lookup(self.organ_image.get_packed())
         self.threshold = 127
 
+        # 輪廓簡化: None 保留所有邊界點；0 只移除共線點 (無損)；
+        # 大於 0 時再以 Douglas-Peucker 簡化，原始邊界點與簡化後多邊形的距離不超過此值 (像素)
+        self.simplify = simplify
+        self.chain_approx = cv2.CHAIN_APPROX_NONE if simplify is None else cv2.CHAIN_APPROX_SIMPLE
+        # 簡化後實際的最大偏差 (像素)，沒有簡化時為 0
+        self.max_deviation = 0.0
+
     def find_organ(self) -> list:
-        _mask = []
-        for mask in self.intersection_set:
-            _mask.append([*mask, ])
+        indices = np.unique(self.label_map)
+        return [[*self.palette.color_of(index), ] for index in indices if index != 0]
 
-        return _mask
+    def get_mask(self, index: int) -> np.ndarray:
+        return self.label_map == index
 
     def filter_from_index(self, index: int):
-        with Image.open(self.organ_image.get_file()) as image:
-            image_arr = np.array(image)
-            for y in range(np.size(image_arr, 1)):
-                for x in range(np.size(image_arr, 0)):
-                    if image_arr[x, y, 0] == self.label_rgb_list[index - 1][0] \
-                            and image_arr[x, y, 1] == self.label_rgb_list[index - 1][1] \
-                            and image_arr[x, y, 2] == self.label_rgb_list[index - 1][2]:
-                        image_arr[x, y] = 255
-                    else:
-                        image_arr[x, y] = 0
-            return image_arr
+        mask = self.get_mask(index).view(np.uint8) * 255
+        return np.repeat(mask[:, :, np.newaxis], 3, axis=2)
 
     def get_contours(self, filter_image):
-        image_gray = cv2.cvtColor(filter_image, cv2.COLOR_BGR2GRAY)
-        _, threshold = cv2.threshold(image_gray, self.threshold, 255, 0)
-        contours, _ = cv2.findContours(threshold, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if filter_image.ndim == 3:
+            image_gray = cv2.cvtColor(filter_image, cv2.COLOR_BGR2GRAY)
+            _, threshold = cv2.threshold(image_gray, self.threshold, 255, 0)
+        else:
+            # 二值遮罩 (bool) 直接以 uint8 視圖交給 findContours，不需複製
+            threshold = filter_image.view(np.uint8) if filter_image.dtype == np.bool_ else filter_image
+
+        contours = self.__find_contours(threshold)
         if len(contours) == 0:
             return None
 
         return contours
 
+    def get_all_contours(self) -> dict:
+        # 一次掃描取得所有標籤的邊界框，每個器官只在自己的 ROI 內找輪廓
+        all_contours = {}
+        height, width = self.label_map.shape
+        for index, roi in enumerate(ndimage.find_objects(self.label_map), start=1):
+            if roi is None:
+                continue
+
+            # 向外多取 1 像素，讓 ROI 內的輪廓與整張影像上找到的一致
+            y1, y2 = max(roi[0].start - 1, 0), min(roi[0].stop + 1, height)
+            x1, x2 = max(roi[1].start - 1, 0), min(roi[1].stop + 1, width)
+            mask = self.label_map[y1:y2, x1:x2] == index
+            all_contours[index] = self.__find_contours(mask.view(np.uint8), offset=(x1, y1))
+
+        return all_contours
+
+    def __find_contours(self, mask: np.ndarray, offset=(0, 0)):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, self.chain_approx, offset=offset)
+        if self.simplify:
+            simplified = [cv2.approxPolyDP(contour, self.simplify, True) for contour in contours]
+            for contour, polygon in zip(contours, simplified):
+                self.max_deviation = max(self.max_deviation, polygon_deviation(boundary_points(contour), polygon))
+
+            contours = simplified
+
+        return contours
+
     def get_index(self, xyz) -> int:
-        return self.label_rgb_list.index(xyz) + 1
+        return self.palette.index_of(xyz)
 
     def get_name(self, index):
         return self.label_list.get_name(index - 1)
@@ -1,7 +1,9 @@
+import hashlib
 import json
 
 from ..serialize.ISerializable import ISerializable
 from ..utils.ProgressBar import ProgressBar
+from ..vhp.OrganPalette import OrganPalette
 
 
 class OrganLabel(ISerializable):
@@ -26,16 +28,22 @@ class OrganLabel(ISerializable):
             self.deserialize_file = label_file
             self.deserialize()
 
+        # 載入時建立一次顏色清單與索引，之後重複使用
+        self.rgb_list = [label[1] for label in self.labels]
+        self.palette = OrganPalette(self.rgb_list)
+
     def get_rgb_list(self):
-        rgb_set = []
-        for label in self.labels:
-            rgb_set.append(label[1])
+        return self.rgb_list
 
-        return rgb_set
+    def get_palette(self) -> OrganPalette:
+        return self.palette
 
     def get_name(self, index):
         return self.labels[index][0]
 
+    def get_hash(self) -> str:
+        return hashlib.sha1(self.serialize().encode('utf-8')).hexdigest()
+
     def serialize(self):
         data = {}
         for n in range(0, len(self.labels)):
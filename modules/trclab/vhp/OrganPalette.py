@@ -0,0 +1,66 @@
+import numpy as np
+from types import MappingProxyType
+
+from ..utils.RGBColor import pack_rgb
+
+
+class OrganPalette:
+    """ 標籤顏色的唯讀索引，顏色 (打包為 0x00RRGGBB) 對應到從 1 開始的器官索引，0 表示不在標籤內 """
+
+    LUT_SIZE = 1 << 24
+
+    def __init__(self, rgb_list: list):
+        self._colors = tuple(tuple(int(c) for c in rgb) for rgb in rgb_list)
+
+        # 相同顏色以第一個標籤為準
+        index_of = {}
+        for index, rgb in enumerate(self._colors, start=1):
+            index_of.setdefault(self.pack(rgb), index)
+
+        self._index_of = MappingProxyType(index_of)
+        self._lut = None
+
+    @staticmethod
+    def pack(rgb) -> int:
+        return (int(rgb[0]) << 16) | (int(rgb[1]) << 8) | int(rgb[2])
+
+    def __len__(self):
+        return len(self._colors)
+
+    @property
+    def index_map(self) -> MappingProxyType:
+        return self._index_of
+
+    def index_of(self, rgb) -> int:
+        return self._index_of.get(self.pack(rgb), 0)
+
+    def color_of(self, index: int) -> tuple:
+        return self._colors[index - 1]
+
+    def get_lut(self) -> np.ndarray:
+        # 2^24 項查找表，第一次使用時才建立；器官數少於 256 時只需 16MB
+        if self._lut is None:
+            dtype = np.uint8 if len(self._colors) < 256 else np.uint16
+            lut = np.zeros(self.LUT_SIZE, dtype=dtype)
+            if self._index_of:
+                lut[np.fromiter(self._index_of.keys(), dtype=np.uint32)] = list(self._index_of.values())
+
+            lut.flags.writeable = False
+            self._lut = lut
+
+        return self._lut
+
+    def lookup(self, packed) -> np.ndarray:
+        return self.get_lut()[packed]
+
+    def lookup_rgb(self, rgb) -> np.ndarray:
+        return self.lookup(pack_rgb(rgb))
+
+    def __getstate__(self):
+        # 查找表由各程序自行建立，不隨 pickle 傳送
+        return {'_colors': self._colors, '_index_of': dict(self._index_of), '_lut': None}
+
+    def __setstate__(self, state):
+        self._colors = state['_colors']
+        self._index_of = MappingProxyType(state['_index_of'])
+        self._lut = None
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+
+class RegionCache:
+    """ 以 (分割圖片雜湊, 標籤雜湊, 輪廓設定) 為鍵，將每張圖片的 VIA regions 存在磁碟上，超過容量時淘汰最久未使用的項目
+
+    put 不會每次掃描整個目錄，每個程序寫入的量累積超過容量的 1/EVICT_FRACTION 才執行 evict，
+    執行結束時再由呼叫端呼叫 evict 一次
+    """
+
+    EVICT_FRACTION = 16
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 上次 evict 之後本程序寫入的位元組數
+        self.written_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        sha = hashlib.sha1()
+        with open(file_path, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(1 << 20), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    def make_key(self, segmentation_file: str, label, settings: str) -> str:
+        sha = hashlib.sha1()
+        for part in (self.file_hash(segmentation_file), label.get_hash(), settings):
+            sha.update(part.encode('utf-8'))
+            sha.update(b'\0')
+
+        return sha.hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key: str):
+        path = self.__path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as in_file:
+                regions = json.load(in_file)
+
+            # 以修改時間記錄最後使用時間
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return regions
+
+    def put(self, key: str, regions: dict):
+        path = self.__path(key)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as out_file:
+            json.dump(regions, out_file, default=int)
+
+        self.written_bytes += os.path.getsize(temp_path)
+        # 先寫入暫存檔再替換，多個程序同時寫入也不會讀到寫到一半的檔案
+        os.replace(temp_path, path)
+        if self.written_bytes * self.EVICT_FRACTION > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        self.written_bytes = 0
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.cache_dir) as scanned:
+            for entry in scanned:
+                if not entry.name.endswith(".json"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total_bytes -= size
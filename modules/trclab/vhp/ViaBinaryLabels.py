@@ -0,0 +1,246 @@
+import json
+import numpy as np
+import os
+import shutil
+import threading
+
+SIDECAR_VERSION = 1
+
+
+def sidecar_path(json_file: str) -> str:
+    return os.path.splitext(json_file)[0] + ".labels"
+
+
+def source_stat(json_file: str) -> list:
+    stat = os.stat(json_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ViaBinaryWriter:
+    """ 將 VIA 標記資料寫成可記憶體映射的二進位格式 (目錄內多個 .npy 與 meta.json)
+
+    points.npy          float32 [點數, (x, y)]  所有多邊形頂點
+    region_offsets.npy  int64 [區域數 + 1]       每個區域在 points 中的起點
+    region_names.npy    int32 [區域數]           區域名稱在 meta.json names 中的索引
+    image_offsets.npy   int64 [圖片數 + 1]       每張圖片在 region 中的起點
+    image_sizes.npy     int64 [圖片數]           目標圖片檔案大小
+    meta.json           keys, filenames, names 與來源 JSON 的狀態，最後寫入，存在時代表檔案完整
+
+    所有檔案先寫在暫存目錄，close 時才改名為 sidecar_dir，
+    不會覆寫其他程序正在記憶體映射的檔案
+    """
+
+    def __init__(self, sidecar_dir: str):
+        self.sidecar_dir = sidecar_dir
+        self.temp_dir = "%s.%d.%d.tmp" % (sidecar_dir, os.getpid(), threading.get_ident())
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        os.makedirs(self.temp_dir)
+
+        # 頂點先以原始格式逐筆附加到暫存檔，不在記憶體中累積
+        self.points_path = os.path.join(self.temp_dir, "points.raw")
+        self.points_file = open(self.points_path, 'wb')
+        self.num_points = 0
+        self.region_offsets = [0]
+        self.region_names = []
+        self.image_offsets = [0]
+        self.image_sizes = []
+        self.keys = []
+        self.filenames = []
+        self.names = {}
+
+    def write(self, key: str, value: dict):
+        regions = value['regions']
+        if type(regions) is dict:
+            regions = regions.values()
+
+        for region in regions:
+            shape = region['shape_attributes']
+            points = np.empty((len(shape['all_points_x']), 2), dtype=np.float32)
+            points[:, 0] = shape['all_points_x']
+            points[:, 1] = shape['all_points_y']
+            self.points_file.write(points.tobytes())
+            self.num_points += len(points)
+            self.region_offsets.append(self.num_points)
+
+            name = region['region_attributes'].get('name', '')
+            self.region_names.append(self.names.setdefault(name, len(self.names)))
+
+        self.image_offsets.append(len(self.region_names))
+        self.image_sizes.append(int(value.get('size', 0)))
+        self.keys.append(key)
+        self.filenames.append(value['filename'])
+
+    def update(self, data: dict):
+        for key, value in data.items():
+            self.write(key, value)
+
+    def close(self, source_file: str = None):
+        self.points_file.close()
+        points = np.lib.format.open_memmap(os.path.join(self.temp_dir, "points.npy"), mode='w+',
+                                           dtype=np.float32, shape=(self.num_points, 2))
+        if self.num_points:
+            points[:] = np.memmap(self.points_path, dtype=np.float32, mode='r', shape=(self.num_points, 2))
+
+        points.flush()
+        del points
+        os.remove(self.points_path)
+
+        np.save(os.path.join(self.temp_dir, "region_offsets.npy"), np.array(self.region_offsets, dtype=np.int64))
+        np.save(os.path.join(self.temp_dir, "region_names.npy"), np.array(self.region_names, dtype=np.int32))
+        np.save(os.path.join(self.temp_dir, "image_offsets.npy"), np.array(self.image_offsets, dtype=np.int64))
+        np.save(os.path.join(self.temp_dir, "image_sizes.npy"), np.array(self.image_sizes, dtype=np.int64))
+
+        meta = {
+            'version': SIDECAR_VERSION,
+            'keys': self.keys,
+            'filenames': self.filenames,
+            'names': sorted(self.names, key=self.names.get),
+            'source': source_stat(source_file) if source_file is not None else None
+        }
+        with open(os.path.join(self.temp_dir, "meta.json"), 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+
+        self.__publish()
+
+    def __publish(self):
+        # 目錄無法直接覆蓋，先將舊目錄移開再改名；舊檔案刪除後，
+        # 已映射它們的程序仍可繼續讀取 (Windows 上刪除失敗則留待下次)
+        old_dir = None
+        if os.path.exists(self.sidecar_dir):
+            old_dir = "%s.%d.%d.old" % (self.sidecar_dir, os.getpid(), threading.get_ident())
+            try:
+                os.replace(self.sidecar_dir, old_dir)
+            except OSError:
+                old_dir = None
+
+        try:
+            os.replace(self.temp_dir, self.sidecar_dir)
+        except OSError:
+            # 其他程序已先放入同樣內容的二進位檔
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def abort(self):
+        self.points_file.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class ViaBinaryLabels:
+    def __init__(self, sidecar_dir: str, mmap_mode: str = 'r'):
+        self.sidecar_dir = sidecar_dir
+        with open(os.path.join(sidecar_dir, "meta.json"), 'r', encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+
+        self.keys = self.meta['keys']
+        self.filenames = self.meta['filenames']
+        self.names = self.meta['names']
+        self.points = np.load(os.path.join(sidecar_dir, "points.npy"), mmap_mode=mmap_mode)
+        self.region_offsets = np.load(os.path.join(sidecar_dir, "region_offsets.npy"), mmap_mode=mmap_mode)
+        self.region_names = np.load(os.path.join(sidecar_dir, "region_names.npy"), mmap_mode=mmap_mode)
+        self.image_offsets = np.load(os.path.join(sidecar_dir, "image_offsets.npy"), mmap_mode=mmap_mode)
+        self.image_sizes = np.load(os.path.join(sidecar_dir, "image_sizes.npy"), mmap_mode=mmap_mode)
+
+    @staticmethod
+    def is_valid(sidecar_dir: str, json_file: str = None) -> bool:
+        try:
+            with open(os.path.join(sidecar_dir, "meta.json"), 'r', encoding='utf-8') as in_file:
+                meta = json.load(in_file)
+
+            if not isinstance(meta, dict) or meta.get('version') != SIDECAR_VERSION:
+                return False
+
+            # 來源 JSON 修改過後，二進位檔視為過期
+            return json_file is None or meta.get('source') == source_stat(json_file)
+        except (OSError, ValueError):
+            # meta.json 不存在或無法讀取
+            return False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def region_range(self, image_index: int) -> range:
+        return range(int(self.image_offsets[image_index]), int(self.image_offsets[image_index + 1]))
+
+    def polygon(self, region_index: int) -> np.ndarray:
+        return self.points[self.region_offsets[region_index]:self.region_offsets[region_index + 1]]
+
+    def annotation(self, image_index: int) -> dict:
+        # 與 VIA JSON 相同的結構，頂點為記憶體映射的陣列視圖
+        regions = []
+        for region_index in self.region_range(image_index):
+            points = self.polygon(region_index)
+            regions.append({
+                'shape_attributes': {'name': 'polygon', 'all_points_x': points[:, 0], 'all_points_y': points[:, 1]},
+                'region_attributes': {'name': self.names[self.region_names[region_index]]}
+            })
+
+        return {
+            'fileref': '',
+            'size': int(self.image_sizes[image_index]),
+            'filename': self.filenames[image_index],
+            'base64_img_data': '',
+            'file_attributes': {},
+            'regions': regions
+        }
+
+    def __iter__(self):
+        for image_index in range(len(self)):
+            yield self.annotation(image_index)
+
+
+def write_sidecar(json_file: str, annotations: dict) -> bool:
+    writer = None
+    try:
+        writer = ViaBinaryWriter(sidecar_path(json_file))
+        writer.update(annotations)
+        writer.close(json_file)
+    except (OSError, ValueError):
+        # 資料集目錄無法寫入時仍可使用 JSON
+        if writer is not None:
+            writer.abort()
+
+        return False
+
+    return True
+
+
+def load_via_labels(json_file: str, build_sidecar: bool = False):
+    """ 回傳記憶體映射的 ViaBinaryLabels；二進位檔不存在或過期時，build_sidecar 為 True 才由 JSON 建立，
+    否則回傳 None (讀取時預設不在資料集目錄寫入任何檔案) """
+    sidecar_dir = sidecar_path(json_file)
+    if not ViaBinaryLabels.is_valid(sidecar_dir, json_file):
+        if not build_sidecar:
+            return None
+
+        with open(json_file, 'r', encoding='utf-8') as in_file:
+            annotations = json.load(in_file)
+
+        if not write_sidecar(json_file, annotations):
+            return None
+
+    try:
+        return ViaBinaryLabels(sidecar_dir)
+    except (OSError, ValueError):
+        # 其他程序正在替換二進位檔
+        return None
+
+
+def load_via_annotations(json_file: str, build_sidecar: bool = False) -> list:
+    """ 讀取 VIA 標記資料，有最新的二進位檔時直接記憶體映射，否則讀取 JSON；build_sidecar 為 True 時建立二進位檔供下次使用 """
+    sidecar_dir = sidecar_path(json_file)
+    if ViaBinaryLabels.is_valid(sidecar_dir, json_file):
+        try:
+            return list(ViaBinaryLabels(sidecar_dir))
+        except (OSError, ValueError):
+            # 其他程序正在替換二進位檔，改讀 JSON
+            pass
+
+    with open(json_file, 'r', encoding='utf-8') as in_file:
+        annotations = json.load(in_file)
+
+    if build_sidecar:
+        write_sidecar(json_file, annotations)
+
+    return list(annotations.values())
@@ -0,0 +1,144 @@
+import json
+import os
+
+
+class ViaJsonWriter:
+    """ 逐筆寫入 VIA 標記資料，每筆資料獨立一行，隨時中斷都能從檔案中回復已完成的部分 """
+
+    def __init__(self, output_file: str, resume: bool = False, cls=None, sidecar=None):
+        self.output_file = output_file
+        self.cls = cls
+        self.sidecar = sidecar
+        self.written_keys = set()
+        self.file = None
+
+        if resume:
+            recovered = self.__open_resume(output_file)
+        else:
+            recovered = dict()
+            self.file = open(output_file, 'w', encoding='utf-8')
+            self.file.write("{")
+
+        # 已在檔案中的資料不再重寫，只補寫二進位檔
+        self.written_keys.update(recovered)
+        if self.sidecar is not None:
+            self.sidecar.update(recovered)
+
+    def __open_resume(self, output_file: str) -> dict:
+        recovered = self.recover(output_file)
+        scanned, end = self.__scan(output_file)
+        if end is None or len(scanned) < len(recovered):
+            # 檔案不存在或不是逐行格式 (例如其他工具輸出的 JSON)，先寫到暫存檔再取代原檔
+            temp_file = "%s.%d.tmp" % (output_file, os.getpid())
+            with open(temp_file, 'w', encoding='utf-8') as out_file:
+                out_file.write("{")
+                for index, (key, value) in enumerate(recovered.items()):
+                    out_file.write(("\n" if index == 0 else ",\n") + self.__format(key, value))
+
+            os.replace(temp_file, output_file)
+            scanned, end = self.__scan(output_file)
+
+        # 只截掉最後一筆完整資料之後寫到一半的內容，已完成的資料不重寫
+        with open(output_file, 'r+b') as out_file:
+            out_file.truncate(end)
+
+        self.file = open(output_file, 'a', encoding='utf-8')
+        return scanned
+
+    @staticmethod
+    def recover(output_file: str) -> dict:
+        if not os.path.isfile(output_file):
+            return dict()
+
+        with open(output_file, 'r', encoding='utf-8') as in_file:
+            content = in_file.read()
+
+        try:
+            return json.loads(content)
+        except ValueError:
+            pass
+
+        # 檔案未正常結束，逐行取回完整的資料，遇到寫到一半的資料即停止
+        recovered = dict()
+        for line in content.splitlines()[1:]:
+            line = line.rstrip().rstrip(',')
+            try:
+                recovered.update(json.loads("{" + line + "}"))
+            except ValueError:
+                break
+
+        return recovered
+
+    @staticmethod
+    def __scan(output_file: str):
+        """ 與 recover 相同逐行取回資料，並回傳最後一筆完整資料結束的位置；檔案不是逐行格式時位置為 None """
+        if not os.path.isfile(output_file):
+            return dict(), None
+
+        with open(output_file, 'rb') as in_file:
+            lines = in_file.read().split(b"\n")
+
+        if lines[0] != b"{":
+            return dict(), None
+
+        recovered = dict()
+        end = position = len(lines[0])
+        for line in lines[1:]:
+            entry = line[:-1] if line.endswith(b",") else line
+            if not entry.strip():
+                break
+
+            try:
+                recovered.update(json.loads(b"{" + entry + b"}"))
+            except ValueError:
+                break
+
+            # 位置包含前面的換行字元，不含結尾的逗號
+            end = position + 1 + len(entry)
+            position += 1 + len(line)
+
+        return recovered, end
+
+    def __format(self, key: str, value: dict) -> str:
+        return json.dumps(key) + ": " + json.dumps(value, default=int, cls=self.cls)
+
+    def write(self, key: str, value: dict):
+        separator = ",\n" if self.written_keys else "\n"
+        self.file.write(separator + self.__format(key, value))
+        self.file.flush()
+        self.written_keys.add(key)
+        if self.sidecar is not None:
+            self.sidecar.write(key, value)
+
+    def update(self, data: dict):
+        for key, value in data.items():
+            self.write(key, value)
+
+    def close(self):
+        if self.file is None:
+            return
+
+        self.file.write("\n}")
+        self.file.close()
+        self.file = None
+        if self.sidecar is not None:
+            self.sidecar.close(self.output_file)
+
+    def __contains__(self, key):
+        return key in self.written_keys
+
+    def __len__(self):
+        return len(self.written_keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self.file is not None:
+            # 發生錯誤時保留未結尾的檔案，之後以 resume 接續
+            self.file.close()
+            self.file = None
+            if self.sidecar is not None:
+                self.sidecar.abort()
@@ -1,2 +1,4 @@
 from .OrganDataset import OrganDataset
 from .OrganLabel import OrganLabel
+from .RegionCache import RegionCache
+from .ViaBinaryLabels import ViaBinaryLabels, load_via_annotations, load_via_labels
@@ -5,8 +5,6 @@ import numpy as np
 import os
 import pandas as pd
 import random
-import skimage.draw
-import skimage.io
 import sys
 from sklearn.metrics import confusion_matrix
 
@@ -15,12 +13,13 @@ from modules.mrcnn import utils, visualize
 from modules.mrcnn import model as model_lib
 from modules.mrcnn.config import Config
 from modules.trclab import config as docs
+from modules.trclab.dataset import PeritonealDataset
 
 
 # noinspection DuplicatedCode
 def inference(show_image=True, verbose=0, generator=True):
     config = InferenceConfigConfig()
-    dataset = PeritonealDataset()
+    dataset = PeritonealDataset(TRAINING_NAME, CLASSES)
     dataset.load_peritoneal(docs.DATASET_KFOLD_C, "val")
     dataset.prepare()
 
@@ -160,70 +159,6 @@ if __name__ == '__main__':
     print("Classes Count:", len(CLASSES))
 
 
-    class PeritonealDataset(utils.Dataset):
-        # noinspection DuplicatedCode
-        def load_peritoneal(self, dataset_dir, subset):
-            for idx, x in enumerate(CLASSES):
-                self.add_class(TRAINING_NAME, idx + 1, x)
-
-            assert subset in ["train", "val"]
-            dataset_dir = os.path.join(dataset_dir, subset)
-
-            annotations = json.load(open(os.path.join(dataset_dir, "via_region_data.json")))
-            annotations = list(annotations.values())
-            annotations = [a for a in annotations if a['regions']]
-
-            for a in annotations:
-                if type(a['regions']) is dict:
-                    polygons = [r['shape_attributes'] for r in a['regions'].values()]
-                    names = [r['region_attributes'] for r in a['regions'].values()]
-
-                else:
-                    polygons = [r['shape_attributes'] for r in a['regions']]
-                    names = [r['region_attributes'] for r in a['regions']]
-
-                image_path = os.path.join(dataset_dir, a['filename'])
-                image = skimage.io.imread(image_path)
-                height, width = image.shape[:2]
-
-                self.add_image(
-                    TRAINING_NAME,
-                    image_id=a['filename'],  # use file name as a unique image id
-                    path=image_path,
-                    width=width, height=height,
-                    polygons=polygons, names=names)
-
-        # noinspection DuplicatedCode
-        def load_mask(self, image_id):
-            image_info = self.image_info[image_id]
-            class_names = image_info["names"]
-            if image_info["source"] != TRAINING_NAME:
-                return super(self.__class__, self).load_mask(image_id)
-
-            info = self.image_info[image_id]
-            mask = np.zeros([info["height"], info["width"], len(info["polygons"])],
-                            dtype=np.uint8)
-            for i, p in enumerate(info["polygons"]):
-                rr, cc = skimage.draw.polygon(p['all_points_y'], p['all_points_x'])
-                mask[rr, cc, i] = 1
-
-            class_ids = np.zeros([len(info["polygons"])])
-            for i, p in enumerate(class_names):
-                if p['name'] in CLASSES:
-                    class_ids[i] = CLASSES.index(p['name']) + 1
-
-            class_ids = class_ids.astype(int)
-            return mask.astype(np.bool_), class_ids
-
-        def image_reference(self, image_id):
-            """Return the docs of the image."""
-            info = self.image_info[image_id]
-            if info["source"] == TRAINING_NAME:
-                return info["docs"]
-            else:
-                super(self.__class__, self).image_reference(image_id)
-
-
     class InferenceConfigConfig(Config):
         NAME = TRAINING_NAME
         IMAGES_PER_GPU = 1
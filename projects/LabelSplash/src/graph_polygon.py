@@ -1,5 +1,4 @@
 import cv2
-import json
 import numpy as np
 import os
 import random
@@ -8,6 +7,7 @@ import sys
 # Import doc.config
 sys.path.append("../../../")
 from modules.trclab import config
+from modules.trclab.vhp.ViaBinaryLabels import load_via_annotations
 
 
 def random_color():
@@ -20,11 +20,7 @@ def main():
     files = [os.path.join(image_dir, f) for f in os.listdir(image_dir)]
     img_file = random.choice(files)
 
-    with open(os.path.join(config.LOGS_DIR, "CtTurnRight5Degree.json"), 'r') as json_file:
-        json_data = json.load(json_file)
-
-    if json_data is None:
-        return
+    annotations = load_via_annotations(os.path.join(config.LOGS_DIR, "CtTurnRight5Degree.json"))
 
     filename_hj = "{}{}".format(os.path.basename(img_file), os.path.getsize(img_file))
     # filename_or = os.docs.join(
@@ -33,8 +29,9 @@ def main():
     #         os.docs.basename(img_file)
     #         os.docs.basename(img_file).split('.')[0]
     #     )
-    data = json_data[filename_hj]
-    size = len(data["regions"])
+    data = next((a for a in annotations if "{}{}".format(a["filename"], a["size"]) == filename_hj), None)
+    if data is None:
+        return
 
     image_h = cv2.imread(img_file)
 
@@ -43,9 +40,12 @@ def main():
     mask_image_h = np.array(image_h)
     # mask_image_o = np.array(image_o)
 
+    # JSON 的區域為 dict，二進位標記檔為 list
     regions = data["regions"]
-    for idx in range(size):
-        region = regions[str(idx)]
+    if type(regions) is dict:
+        regions = regions.values()
+
+    for region in regions:
         shape_attributes = region["shape_attributes"]
         points_x = shape_attributes["all_points_x"]
         points_y = shape_attributes["all_points_y"]
@@ -0,0 +1,58 @@
+import sys
+import timeit
+import numpy as np
+
+# 為系統添加此專案路徑，來找到 mrcnn 函式庫
+sys.path.append("../../../")
+from modules.mrcnn import utils
+
+
+def extract_bboxes_legacy(mask):
+    """ 原本逐個實例呼叫 np.any 的版本，作為比對基準 """
+    boxes = np.zeros([mask.shape[-1], 4], dtype=np.int32)
+    for i in range(mask.shape[-1]):
+        m = mask[:, :, i]
+        horizontal_indicies = np.where(np.any(m, axis=0))[0]
+        vertical_indicies = np.where(np.any(m, axis=1))[0]
+        if horizontal_indicies.shape[0]:
+            x1, x2 = horizontal_indicies[[0, -1]]
+            y1, y2 = vertical_indicies[[0, -1]]
+            x2 += 1
+            y2 += 1
+        else:
+            x1, x2, y1, y2 = 0, 0, 0, 0
+        boxes[i] = np.array([y1, x1, y2, x2])
+    return boxes.astype(np.int32)
+
+
+def random_masks(count, size, rng):
+    """ 隨機矩形遮罩，約十分之一為空遮罩 (模擬裁切後消失的實例) """
+    masks = np.zeros((size, size, count), dtype=bool)
+    for i in range(count):
+        if rng.rand() < 0.1:
+            continue
+        y1, x1 = rng.randint(0, size - 1, 2)
+        y2, x2 = rng.randint(y1 + 1, size + 1), rng.randint(x1 + 1, size + 1)
+        masks[y1:y2, x1:x2, i] = True
+    return masks
+
+
+if __name__ == '__main__':
+    REPEAT = 5
+    SIZE = 1024
+    rng = np.random.RandomState(0)
+    for count in [1, 5, 10, 30, 60, 100]:
+        masks = random_masks(count, SIZE, rng)
+        packed = utils.PackedMasks.from_dense(masks)
+        encoded = utils.RLEMasks.from_dense(masks)
+
+        expected = extract_bboxes_legacy(masks)
+        same = all(np.array_equal(expected, utils.extract_bboxes(m)) for m in [masks, packed, encoded])
+
+        legacy = min(timeit.repeat(lambda: extract_bboxes_legacy(masks), number=1, repeat=REPEAT))
+        vectorized = min(timeit.repeat(lambda: utils.extract_bboxes(masks), number=1, repeat=REPEAT))
+        from_packed = min(timeit.repeat(lambda: utils.extract_bboxes(packed), number=1, repeat=REPEAT))
+        from_rle = min(timeit.repeat(lambda: utils.extract_bboxes(encoded), number=1, repeat=REPEAT))
+        print("N {:3d}  legacy {:8.2f} ms  vectorized {:8.2f} ms  packed {:7.2f} ms  RLE {:6.2f} ms  "
+              "speedup {:5.2f}x  identical {}".format(count, legacy * 1000, vectorized * 1000, from_packed * 1000,
+                                                      from_rle * 1000, legacy / vectorized, same))
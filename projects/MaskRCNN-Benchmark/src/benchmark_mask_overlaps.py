@@ -0,0 +1,56 @@
+import sys
+import timeit
+import numpy as np
+
+# 為系統添加此專案路徑，來找到 mrcnn 函式庫
+sys.path.append("../../../")
+from modules.mrcnn import utils
+
+
+def compute_overlaps_masks_legacy(masks1, masks2):
+    """ 原本將遮罩攤平成 float32 後做矩陣乘法的版本，作為比對基準 """
+    if masks1.shape[-1] == 0 or masks2.shape[-1] == 0:
+        return np.zeros((masks1.shape[-1], masks2.shape[-1]))
+    masks1 = np.reshape(masks1 > .5, (-1, masks1.shape[-1])).astype(np.float32)
+    masks2 = np.reshape(masks2 > .5, (-1, masks2.shape[-1])).astype(np.float32)
+    area1 = np.sum(masks1, axis=0)
+    area2 = np.sum(masks2, axis=0)
+    intersections = np.dot(masks1.T, masks2)
+    union = area1[:, None] + area2[None, :] - intersections
+    return intersections / union
+
+
+def random_organ_masks(count, size, rng):
+    """ 以橢圓模擬器官遮罩 """
+    yy, xx = np.mgrid[:size, :size]
+    masks = np.zeros((size, size, count), dtype=bool)
+    for i in range(count):
+        cy, cx = rng.uniform(0, size, 2)
+        ry, rx = rng.uniform(20, 200, 2)
+        masks[:, :, i] = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 < 1
+    return masks
+
+
+if __name__ == '__main__':
+    REPEAT = 3
+    rng = np.random.RandomState(0)
+    for count in [5, 15, 30, 60]:
+        gt_masks = random_organ_masks(count, 1024, rng)
+        pr_masks = random_organ_masks(count, 1024, rng)
+
+        expected = compute_overlaps_masks_legacy(gt_masks, pr_masks)
+        gt_rle = utils.RLEMasks.from_dense(gt_masks)
+        pr_rle = utils.RLEMasks.from_dense(pr_masks)
+        same = np.array_equal(expected, utils.compute_overlaps_masks(gt_masks, pr_masks), equal_nan=True) and \
+            np.array_equal(expected, gt_rle.iou(pr_rle), equal_nan=True)
+
+        legacy = min(timeit.repeat(lambda: compute_overlaps_masks_legacy(gt_masks, pr_masks),
+                                   number=1, repeat=REPEAT))
+        dense = min(timeit.repeat(lambda: utils.compute_overlaps_masks(gt_masks, pr_masks),
+                                  number=1, repeat=REPEAT))
+        encoded = min(timeit.repeat(lambda: utils.compute_overlaps_masks(gt_rle, pr_rle),
+                                    number=1, repeat=REPEAT))
+        print("instances {:3d}  legacy {:8.2f} ms  RLE from dense {:8.2f} ms  RLE only {:7.2f} ms  "
+              "float32 copy {:6.1f} MB  RLE {:6.2f} MB  identical {}".format(
+                  count, legacy * 1000, dense * 1000, encoded * 1000,
+                  (gt_masks.size + pr_masks.size) * 4 / 2 ** 20, (gt_rle.nbytes + pr_rle.nbytes) / 2 ** 20, same))
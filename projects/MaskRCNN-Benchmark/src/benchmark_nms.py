@@ -0,0 +1,86 @@
+import sys
+import timeit
+import numpy as np
+
+# 為系統添加此專案路徑，來找到 mrcnn 函式庫
+sys.path.append("../../../")
+from modules.mrcnn import utils
+
+
+def non_max_suppression_legacy(boxes, scores, threshold):
+    """ 原本每次保留一個框就 np.delete 兩次的版本，作為比對基準 """
+    assert boxes.shape[0] > 0
+    if boxes.dtype.kind != "f":
+        boxes = boxes.astype(np.float32)
+
+    y1 = boxes[:, 0]
+    x1 = boxes[:, 1]
+    y2 = boxes[:, 2]
+    x2 = boxes[:, 3]
+    area = (y2 - y1) * (x2 - x1)
+
+    ixs = scores.argsort()[::-1]
+    pick = []
+    while len(ixs) > 0:
+        i = ixs[0]
+        pick.append(i)
+        iou = utils.compute_iou(boxes[i], boxes[ixs[1:]], area[i], area[ixs[1:]])
+        remove_ixs = np.where(iou > threshold)[0] + 1
+        ixs = np.delete(ixs, remove_ixs)
+        ixs = np.delete(ixs, 0)
+    return np.array(pick, dtype=np.int32)
+
+
+def random_proposals(count, size, rng, objects=100):
+    """ 模擬 RPN 提案框：集中在少數物件附近並帶有抖動 """
+    centers = rng.uniform(0, size, (objects, 2))
+    sizes = rng.uniform(32, 256, (objects, 2))
+    owner = rng.randint(0, objects, count)
+    center = centers[owner] + rng.normal(0, 0.1, (count, 2)) * sizes[owner]
+    half = sizes[owner] * rng.uniform(0.35, 0.65, (count, 2))
+    boxes = np.concatenate([center - half, center + half], axis=1)
+    return np.clip(boxes, 0, size).astype(np.float32), rng.rand(count).astype(np.float32)
+
+
+if __name__ == '__main__':
+    THRESHOLD = 0.7
+    rng = np.random.RandomState(0)
+    for count in [100, 500, 1000, 5000, 10000, 20000, 50000]:
+        boxes, scores = random_proposals(count, 1024, rng)
+        repeat = 5 if count <= 5000 else 1
+
+        expected = non_max_suppression_legacy(boxes, scores, THRESHOLD)
+        results = [utils.non_max_suppression_tiled(boxes, scores, THRESHOLD)]
+        if count <= 5000:
+            results.append(utils.non_max_suppression_matrix(boxes, scores, THRESHOLD))
+        same = all(np.array_equal(expected, r) for r in results)
+
+        legacy = min(timeit.repeat(lambda: non_max_suppression_legacy(boxes, scores, THRESHOLD),
+                                   number=1, repeat=repeat))
+        matrix = min(timeit.repeat(lambda: utils.non_max_suppression_matrix(boxes, scores, THRESHOLD),
+                                   number=1, repeat=repeat)) if count <= 5000 else float("nan")
+        tiled = min(timeit.repeat(lambda: utils.non_max_suppression_tiled(boxes, scores, THRESHOLD),
+                                  number=1, repeat=repeat))
+        print("boxes {:5d}  kept {:5d}  legacy {:9.2f} ms  matrix {:9.2f} ms  tiled {:9.2f} ms  "
+              "identical {}".format(count, expected.shape[0], legacy * 1000, matrix * 1000, tiled * 1000, same))
+
+    # 分類別 NMS 與逐類別呼叫原本版本的結果相同；Soft-NMS 只計時
+    boxes, scores = random_proposals(5000, 1024, rng)
+    class_ids = rng.randint(1, 11, boxes.shape[0])
+    expected = [np.where(class_ids == c)[0][non_max_suppression_legacy(boxes[class_ids == c], scores[class_ids == c],
+                                                                       THRESHOLD)]
+                for c in np.unique(class_ids)]
+    keep = utils.batched_non_max_suppression(boxes, scores, class_ids, THRESHOLD)
+    same = np.array_equal(np.sort(np.concatenate(expected)), np.sort(keep))
+    batched = min(timeit.repeat(lambda: utils.batched_non_max_suppression(boxes, scores, class_ids, THRESHOLD),
+                                number=1, repeat=5))
+    print("batched NMS  boxes {:5d}  classes 10  {:9.2f} ms  identical {}".format(
+        boxes.shape[0], batched * 1000, same))
+
+    boxes, scores = random_proposals(2000, 1024, rng)
+    for method in ["linear", "gaussian"]:
+        soft = min(timeit.repeat(lambda: utils.soft_non_max_suppression(boxes, scores, method=method),
+                                 number=1, repeat=3))
+        print("soft-NMS {:8s}  boxes {:5d}  kept {:5d}  {:9.2f} ms".format(
+            method, boxes.shape[0], utils.soft_non_max_suppression(boxes, scores, method=method)[0].shape[0],
+            soft * 1000))
@@ -0,0 +1,50 @@
+import sys
+import timeit
+import numpy as np
+
+# 為系統添加此專案路徑，來找到 mrcnn 函式庫
+sys.path.append("../../../")
+from modules.mrcnn import utils
+
+
+def compute_overlaps_legacy(boxes1, boxes2):
+    """ 原本逐欄呼叫 compute_iou 的版本，作為比對基準 """
+    area1 = utils.compute_box_areas(boxes1)
+    area2 = utils.compute_box_areas(boxes2)
+    overlaps = np.zeros((boxes1.shape[0], boxes2.shape[0]))
+    for i in range(overlaps.shape[1]):
+        overlaps[:, i] = utils.compute_iou(boxes2[i], boxes1, area2[i], area1)
+    return overlaps
+
+
+def random_boxes(count, size, rng, dtype=np.float32):
+    y1 = rng.randint(0, size - 64, count)
+    x1 = rng.randint(0, size - 64, count)
+    h = rng.randint(8, 512, count)
+    w = rng.randint(8, 512, count)
+    return np.stack([y1, x1, np.minimum(y1 + h, size), np.minimum(x1 + w, size)], axis=1).astype(dtype)
+
+
+if __name__ == '__main__':
+    REPEAT = 5
+    rng = np.random.RandomState(0)
+    # (boxes1, boxes2)：ROI 對 GT、全部錨點對 GT
+    for count1, count2 in [(200, 30), (2000, 100), (261888, 20), (261888, 100)]:
+        boxes1 = random_boxes(count1, 1024, rng)
+        boxes2 = random_boxes(count2, 1024, rng)
+
+        expected = compute_overlaps_legacy(boxes1, boxes2)
+        same = np.array_equal(expected, utils.compute_overlaps(boxes1, boxes2))
+        same_float32 = np.array_equal(expected.astype(np.float32),
+                                      utils.compute_overlaps(boxes1, boxes2, dtype=np.float32))
+
+        legacy = min(timeit.repeat(lambda: compute_overlaps_legacy(boxes1, boxes2), number=1, repeat=REPEAT))
+        single = min(timeit.repeat(lambda: utils.compute_overlaps(boxes1, boxes2, block_size=None),
+                                   number=1, repeat=REPEAT))
+        blocked = min(timeit.repeat(lambda: utils.compute_overlaps(boxes1, boxes2), number=1, repeat=REPEAT))
+        blocked32 = min(timeit.repeat(lambda: utils.compute_overlaps(boxes1, boxes2, dtype=np.float32),
+                                      number=1, repeat=REPEAT))
+        print("{:6d} x {:3d}  legacy {:8.2f} ms  single pass {:8.2f} ms  blocked {:8.2f} ms  "
+              "blocked float32 {:8.2f} ms  speedup {:4.2f}x  identical {} / {}".format(
+                  count1, count2, legacy * 1000, single * 1000, blocked * 1000, blocked32 * 1000,
+                  legacy / blocked, same, same_float32))
@@ -0,0 +1,127 @@
+import sys
+import timeit
+import numpy as np
+
+# 為系統添加此專案路徑，來找到 mrcnn 函式庫
+sys.path.append("../../../")
+from modules.mrcnn import model as model_lib, utils
+from modules.mrcnn.config import Config
+
+
+class BenchmarkConfig(Config):
+    NAME = "benchmark"
+    NUM_CLASSES = 1 + 10
+    IMAGES_PER_GPU = 1
+
+
+def build_rpn_targets_legacy(image_shape, anchors, gt_class_ids, gt_boxes, config):
+    """ 改寫前的 build_rpn_targets (逐一 GT 計算 IoU、逐一正樣本計算偏移)，作為比較基準 """
+    rpn_match = np.zeros([anchors.shape[0]], dtype=np.int32)
+    rpn_bbox = np.zeros((config.RPN_TRAIN_ANCHORS_PER_IMAGE, 4))
+
+    crowd_ix = np.where(gt_class_ids < 0)[0]
+    if crowd_ix.shape[0] > 0:
+        non_crowd_ix = np.where(gt_class_ids > 0)[0]
+        crowd_boxes = gt_boxes[crowd_ix]
+        gt_class_ids = gt_class_ids[non_crowd_ix]
+        gt_boxes = gt_boxes[non_crowd_ix]
+        crowd_overlaps = utils.compute_overlaps(anchors, crowd_boxes)
+        crowd_iou_max = np.amax(crowd_overlaps, axis=1)
+        no_crowd_bool = (crowd_iou_max < 0.001)
+    else:
+        no_crowd_bool = np.ones([anchors.shape[0]], dtype=bool)
+
+    overlaps = utils.compute_overlaps(anchors, gt_boxes)
+    anchor_iou_argmax = np.argmax(overlaps, axis=1)
+    anchor_iou_max = overlaps[np.arange(overlaps.shape[0]), anchor_iou_argmax]
+    rpn_match[(anchor_iou_max < 0.3) & (no_crowd_bool)] = -1
+    gt_iou_argmax = np.argwhere(overlaps == np.max(overlaps, axis=0))[:, 0]
+    rpn_match[gt_iou_argmax] = 1
+    rpn_match[anchor_iou_max >= 0.7] = 1
+
+    ids = np.where(rpn_match == 1)[0]
+    extra = len(ids) - (config.RPN_TRAIN_ANCHORS_PER_IMAGE // 2)
+    if extra > 0:
+        ids = np.random.choice(ids, extra, replace=False)
+        rpn_match[ids] = 0
+    ids = np.where(rpn_match == -1)[0]
+    extra = len(ids) - (config.RPN_TRAIN_ANCHORS_PER_IMAGE -
+                        np.sum(rpn_match == 1))
+    if extra > 0:
+        ids = np.random.choice(ids, extra, replace=False)
+        rpn_match[ids] = 0
+
+    ids = np.where(rpn_match == 1)[0]
+    ix = 0
+    for i, a in zip(ids, anchors[ids]):
+        gt = gt_boxes[anchor_iou_argmax[i]]
+        gt_h = gt[2] - gt[0]
+        gt_w = gt[3] - gt[1]
+        gt_center_y = gt[0] + 0.5 * gt_h
+        gt_center_x = gt[1] + 0.5 * gt_w
+        a_h = a[2] - a[0]
+        a_w = a[3] - a[1]
+        a_center_y = a[0] + 0.5 * a_h
+        a_center_x = a[1] + 0.5 * a_w
+        rpn_bbox[ix] = [
+            (gt_center_y - a_center_y) / a_h,
+            (gt_center_x - a_center_x) / a_w,
+            np.log(gt_h / a_h),
+            np.log(gt_w / a_w),
+        ]
+        rpn_bbox[ix] /= config.RPN_BBOX_STD_DEV
+        ix += 1
+
+    return rpn_match, rpn_bbox
+
+
+def random_gt_boxes(count, size, rng):
+    y1 = rng.randint(0, size - 64, count)
+    x1 = rng.randint(0, size - 64, count)
+    h = rng.randint(16, 256, count)
+    w = rng.randint(16, 256, count)
+    return np.stack([y1, x1, np.minimum(y1 + h, size), np.minimum(x1 + w, size)], axis=1).astype(np.int32)
+
+
+if __name__ == '__main__':
+    CONFIG = BenchmarkConfig()
+    BACKBONE_SHAPES = model_lib.compute_backbone_shapes(CONFIG, CONFIG.IMAGE_SHAPE)
+    ANCHORS = utils.generate_pyramid_anchors(CONFIG.RPN_ANCHOR_SCALES,
+                                             CONFIG.RPN_ANCHOR_RATIOS,
+                                             BACKBONE_SHAPES,
+                                             CONFIG.BACKBONE_STRIDES,
+                                             CONFIG.RPN_ANCHOR_STRIDE)
+    ANCHOR_AREAS = utils.compute_box_areas(ANCHORS)
+    start = timeit.default_timer()
+    ANCHOR_INDEX = utils.AnchorIndex(ANCHORS)
+    print("AnchorIndex build {:.2f} ms".format((timeit.default_timer() - start) * 1000))
+    REPEAT = 20
+    print("Anchors:", ANCHORS.shape[0])
+
+    rng = np.random.RandomState(0)
+    for gt_count in [1, 5, 20, 50]:
+        gt_boxes = random_gt_boxes(gt_count, CONFIG.IMAGE_MAX_DIM, rng)
+        gt_class_ids = rng.randint(1, CONFIG.NUM_CLASSES, gt_count).astype(np.int32)
+        args = (CONFIG.IMAGE_SHAPE, ANCHORS, gt_class_ids, gt_boxes, CONFIG)
+
+        # 相同亂數種子下結果需完全相同
+        np.random.seed(gt_count)
+        expected = build_rpn_targets_legacy(*args)
+        np.random.seed(gt_count)
+        result = model_lib.build_rpn_targets(*args, anchor_areas=ANCHOR_AREAS)
+        np.random.seed(gt_count)
+        indexed_result = model_lib.build_rpn_targets(*args, anchor_areas=ANCHOR_AREAS, anchor_index=ANCHOR_INDEX)
+        same = all(np.array_equal(e, r) and np.array_equal(e, i)
+                   for e, r, i in zip(expected, result, indexed_result))
+
+        legacy = min(timeit.repeat(lambda: build_rpn_targets_legacy(*args), number=1, repeat=REPEAT))
+        vectorized = min(timeit.repeat(lambda: model_lib.build_rpn_targets(*args), number=1, repeat=REPEAT))
+        cached = min(timeit.repeat(lambda: model_lib.build_rpn_targets(*args, anchor_areas=ANCHOR_AREAS),
+                                   number=1, repeat=REPEAT))
+        indexed = min(timeit.repeat(lambda: model_lib.build_rpn_targets(*args, anchor_areas=ANCHOR_AREAS,
+                                                                        anchor_index=ANCHOR_INDEX),
+                                    number=1, repeat=REPEAT))
+        print("GT {:3d}  legacy {:7.2f} ms  vectorized {:7.2f} ms  + area cache {:7.2f} ms  "
+              "+ anchor index {:7.2f} ms  speedup {:4.2f}x  identical {}".format(
+                  gt_count, legacy * 1000, vectorized * 1000, cached * 1000, indexed * 1000,
+                  legacy / indexed, same))
@@ -11,7 +11,7 @@ import settings
 ####################
 # 為系統添加此專案路徑，來找到 mrcnn 函式庫
 sys.path.append("../../../")
-from modules.mrcnn import model as model_lib, visualize
+from modules.mrcnn import model as model_lib, utils, visualize
 from dataset import PeritonealDataset
 
 
@@ -19,15 +19,16 @@ def computed_overlap_set(gt_masks, pr_masks):
     # If either set of masks is empty return empty result
     if gt_masks.shape[-1] == 0 or pr_masks.shape[-1] == 0:
         return np.zeros((gt_masks.shape[-1], pr_masks.shape[-1]))
-    # flatten masks and compute their areas
-    gt_masks = np.reshape(gt_masks > .5, (-1, gt_masks.shape[-1])).astype(np.float32)
-    pr_masks = np.reshape(pr_masks > .5, (-1, pr_masks.shape[-1])).astype(np.float32)
+    # 以行程長度編碼 (RLE) 計算，只有外框重疊的遮罩組合才計算交集
+    gt_masks = utils.RLEMasks.from_dense(gt_masks > .5)
+    pr_masks = utils.RLEMasks.from_dense(pr_masks > .5)
 
-    gt_area = np.sum(gt_masks, axis=0)
-    pr_area = np.sum(pr_masks, axis=0)
+    # 與原本的 float32 矩陣乘法結果相同的型別
+    intersections = gt_masks.intersection(pr_masks).astype(np.float32)
+    gt_area = gt_masks.area().astype(np.float32)
+    pr_area = pr_masks.area().astype(np.float32)
 
     # intersections and union
-    intersections = np.dot(gt_masks.T, pr_masks)
     gt_difference = gt_area[:, None] - intersections
     pr_difference = pr_area[None, :] - intersections
     union = gt_area[:, None] + pr_area[None, :] - intersections
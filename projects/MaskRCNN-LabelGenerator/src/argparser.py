@@ -43,4 +43,88 @@ parser.add_argument(
     metavar="輸出日誌的路徑"
 )
 
+parser.add_argument(
+    '--resume',
+    required=False,
+    action='store_true',
+    help="從中斷的輸出檔案接續產生，略過已完成的圖片"
+)
+
+parser.add_argument(
+    '--workers',
+    required=False,
+    default=None,
+    type=int,
+    metavar="N",
+    help="平行處理的程序數量，預設為可用的 CPU 核心數"
+)
+
+parser.add_argument(
+    '--chunksize',
+    required=False,
+    default=None,
+    type=int,
+    metavar="N",
+    help="每次分派給子程序的圖片數量，預設依程序數量為 4 到 8"
+)
+
+parser.add_argument(
+    '--shard-index',
+    required=False,
+    default=0,
+    type=int,
+    metavar="I",
+    help="此程序負責的分片編號 (0 ~ num-shards - 1)"
+)
+
+parser.add_argument(
+    '--num-shards',
+    required=False,
+    default=1,
+    type=int,
+    metavar="N",
+    help="將分割圖片集拆分給多台機器或多個程序處理的分片數量，各分片請使用不同的輸出檔案名稱"
+)
+
+parser.add_argument(
+    '--no-cache',
+    required=False,
+    action='store_true',
+    help="不使用生成結果快取，所有圖片皆重新計算"
+)
+
+parser.add_argument(
+    '--cache-dir',
+    required=False,
+    default=settings.DEFAULT_CACHE_DIR,
+    metavar="/path/to/cache/",
+    help="生成結果快取的路徑"
+)
+
+parser.add_argument(
+    '--cache-size',
+    required=False,
+    default=settings.DEFAULT_CACHE_SIZE_MB,
+    type=int,
+    metavar="MB",
+    help="生成結果快取的容量上限，超過時淘汰最久未使用的項目"
+)
+
+parser.add_argument(
+    '--simplify',
+    required=False,
+    default=None,
+    type=float,
+    metavar="PIXELS",
+    help="輪廓簡化的最大偏差(像素)。未指定時保留所有邊界點；0 只移除共線點(無損)；"
+         "大於 0 時以 Douglas-Peucker 簡化，任一原始邊界點與簡化後多邊形的距離不超過此值"
+)
+
+parser.add_argument(
+    '--sidecar',
+    required=False,
+    action='store_true',
+    help="同時輸出可記憶體映射的二進位標記檔 (與輸出檔案同名的 .labels 資料夾)"
+)
+
 args = parser.parse_args()
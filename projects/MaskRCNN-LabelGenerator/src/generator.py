@@ -9,8 +9,15 @@ if __name__ == '__main__':
     # 讀取標籤
     vhp_label = vhp.OrganLabel(args.label)
     # 讀入資料集
-    seg_dataset = vhp.OrganDataset(args.segmentation, "*.bmp")
+    seg_dataset = vhp.OrganDataset(args.segmentation, "*.bmp", args.shard_index, args.num_shards)
     # 設置標籤
     seg_dataset.set_label(vhp_label)
+    # 生成結果快取
+    cache = None if args.no_cache else vhp.RegionCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    # 輪廓簡化的最大偏差
+    if args.simplify is not None:
+        print("輪廓簡化: 容許的最大偏差 (設定值) {} 像素，每張圖片實際的最大偏差顯示於處理進度".format(args.simplify))
     # 匯出標記區域根據目標圖片(映射圖片)至輸出位置
-    seg_dataset.export_label_area(args.target, "*.jpg", os.path.join(args.logs, args.output))
+    seg_dataset.export_label_area(args.target, "*.jpg", os.path.join(args.logs, args.output),
+                                  resume=args.resume, workers=args.workers, chunksize=args.chunksize, cache=cache,
+                                  simplify=args.simplify, sidecar=args.sidecar)
@@ -6,3 +6,7 @@ from modules.trclab import config as docs
 
 DEFAULT_LOGS_DIR = os.path.join(docs.LOGS_DIR, "MaskRCNN-LabelGenerator")
 docs.create_folder_if_not_exists(DEFAULT_LOGS_DIR)
+
+# 生成結果快取 (依分割圖片與標籤內容判斷是否需要重新計算)
+DEFAULT_CACHE_DIR = os.path.join(DEFAULT_LOGS_DIR, "cache")
+DEFAULT_CACHE_SIZE_MB = 1024
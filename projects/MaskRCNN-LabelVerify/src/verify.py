@@ -1,6 +1,9 @@
 from argparser import args
-import json
 import os
+import sys
+
+sys.path.append("../../../")
+from modules.trclab.vhp.ViaBinaryLabels import load_via_annotations
 
 
 def verify(image_dir):
@@ -9,30 +12,31 @@ def verify(image_dir):
     if not os.path.exists(label_filepath):
         raise FileNotFoundError("Label JSON file not found in '{}'.".format(image_dir))
 
-    with open(label_filepath, 'r', encoding="utf-8") as json_file:
-        json_data = json.load(json_file)
-        all_passed = True
-        for key in json_data:
-            image_name = key.split(".jpg")[0] + ".jpg"
-            image_path = os.path.join(image_dir, image_name)
-            image_size = int(key.split(".jpg")[1])
-            try:
-                if not os.path.exists(image_path):
-                    all_passed = False
-                    raise FileNotFoundError
-
-                if str(os.path.getsize(image_path)) == image_size:
-                    all_passed = False
-                    raise KeyError
-
-            except FileNotFoundError:
-                print("Key:", key, "File Not Found! \n", image_path)
-
-            except KeyError:
-                print("Size Error: ", image_name, "Actual:", os.path.getsize(image_name))
-
-        if all_passed:
-            print("\r'{}' Pass!! {}".format(image_dir, " "*10))
+    # 有最新的二進位標記檔時直接記憶體映射，不需解析整個 JSON
+    annotations = load_via_annotations(label_filepath)
+    all_passed = True
+    for annotation in annotations:
+        image_name = annotation["filename"]
+        image_path = os.path.join(image_dir, image_name)
+        image_size = int(annotation["size"])
+        key = "{}{}".format(image_name, image_size)
+        try:
+            if not os.path.exists(image_path):
+                all_passed = False
+                raise FileNotFoundError
+
+            if str(os.path.getsize(image_path)) == image_size:
+                all_passed = False
+                raise KeyError
+
+        except FileNotFoundError:
+            print("Key:", key, "File Not Found! \n", image_path)
+
+        except KeyError:
+            print("Size Error: ", image_name, "Actual:", os.path.getsize(image_name))
+
+    if all_passed:
+        print("\r'{}' Pass!! {}".format(image_dir, " "*10))
 
 
 def main():
@@ -26,6 +26,15 @@ EPOCH = 1000
 STEPS_PER_EPOCH = 100
 # 跳過自信度 < 90% 的偵測辨識
 DETECTION_MIN_CONFIDENCE = 0.9
+# 以下兩個快取只在 SAMPLE_STORE_DIR 為 None 時使用
+# 已光柵化遮罩的快取容量 (MB)，以及磁碟快取路徑 (None 表示只存在記憶體)
+MASK_CACHE_SIZE_MB = 1024
+MASK_CACHE_DIR = None
+# 已解碼圖片的快取容量 (MB)，以及記憶體映射的磁碟快取路徑 (None 表示只存在記憶體)
+IMAGE_CACHE_SIZE_MB = 2048
+IMAGE_CACHE_DIR = None
+# 預先縮放好的訓練樣本 (沒有資料增強時，每個 epoch 直接讀取，不需重新縮放)，None 表示不使用
+SAMPLE_STORE_DIR = os.path.join(DEFAULT_LOGS_DIR, "samples")
 
 # # # DON'T TOUCH # # #
 RECOGNIZABLE_NAME = "Peritoneal"
@@ -44,3 +53,4 @@ class TrainingConfig(Config):
     NUM_CLASSES = 1 + CLASSES_NUM
     STEPS_PER_EPOCH = STEPS_PER_EPOCH
     DETECTION_MIN_CONFIDENCE = DETECTION_MIN_CONFIDENCE
+    SAMPLE_STORE_DIR = SAMPLE_STORE_DIR
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modules.mrcnn import model as modellib
+from modules.mrcnn import utils
+from modules.mrcnn.config import Config
+
+
+class CropConfig(Config):
+    NAME = "crop"
+    IMAGES_PER_GPU = 1
+    NUM_CLASSES = 2
+    IMAGE_RESIZE_MODE = "crop"
+    IMAGE_MIN_DIM = 64
+    IMAGE_MAX_DIM = 64
+
+
+class SquareConfig(CropConfig):
+    IMAGE_RESIZE_MODE = "square"
+
+
+class RandomDataset(utils.Dataset):
+    def load_random(self, count):
+        self.add_class("random", 1, "box")
+        for i in range(count):
+            self.add_image("random", image_id=i, path=None)
+
+    def load_image(self, image_id):
+        return np.full((80, 96, 3), image_id * 10, dtype=np.uint8)
+
+    def load_mask(self, image_id):
+        mask = np.zeros((80, 96, 1), dtype=bool)
+        mask[20:50, 30:70] = True
+        return mask, np.array([1], dtype=np.int32)
+
+
+def random_dataset():
+    dataset = RandomDataset()
+    dataset.load_random(4)
+    dataset.prepare()
+    return dataset
+
+
+def test_crop_mode_drops_the_caches(tmp_path):
+    cache = str(tmp_path / "cache")
+    assert modellib.input_pipeline_caches(CropConfig(), None, cache) == (None, None)
+    assert modellib.input_pipeline_caches(CropConfig(), None, True) == (None, None)
+
+
+def test_augmentation_drops_only_the_train_cache(tmp_path):
+    cache = str(tmp_path / "cache")
+    assert modellib.input_pipeline_caches(SquareConfig(), None, cache) == (cache, cache + "_val")
+    assert modellib.input_pipeline_caches(SquareConfig(), object(), cache) == (None, cache + "_val")
+
+
+def test_crop_mode_pipeline_with_tf_data_cache(tmp_path):
+    config = CropConfig()
+    train_cache, val_cache = modellib.input_pipeline_caches(config, None, str(tmp_path / "cache"))
+    for cache in (train_cache, val_cache):
+        pipeline = modellib.build_input_pipeline(random_dataset(), config, cache=cache)
+        inputs, = next(iter(pipeline))
+        assert tuple(inputs[0].shape) == (config.BATCH_SIZE, 64, 64, 3)